@@ -0,0 +1,394 @@
+"""Batched NumPy MLP engine for the neural network modules.
+
+nn.py pushes one column vector at a time through W @ a + b. Here a whole
+batch of samples goes through each layer as a single matmul on
+(batch, features) rows:
+
+    z = A @ W.T + b,    A_next = activation(z)
+
+Weights use the same layout as the pages (modules/nn/weights.ts): one
+(outputs, inputs) matrix per layer, so the nested lists work unchanged in
+both. Pre-activations, activations and gradients are written in place into
+buffers that are allocated once and only grow with the batch size.
+
+The table command reads the JSON that generate_weights.py --json writes,
+either a plain list of weight matrices or, with --biases, a
+{"weights", "biases"} object whose biases are applied too.
+
+Usage:
+    python mlp.py table weights.json --activation relu --samples 5000 [--output table.json]
+    python mlp.py benchmark [--samples 2000]
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from nn import sigma, softmax
+
+
+def _sigmoid(z, out):
+    # 0.5 * (1 + tanh(z / 2)) is the same curve as nn.sigma, without exp overflowing for very negative z
+    np.multiply(z, 0.5, out=out)
+    np.tanh(out, out=out)
+    out += 1.0
+    out *= 0.5
+
+
+def _sigmoid_grad(z, a, out):
+    np.subtract(1.0, a, out=out)
+    out *= a
+
+
+def _relu(z, out):
+    np.maximum(z, 0.0, out=out)
+
+
+def _relu_grad(z, a, out):
+    np.greater(z, 0.0, out=out)
+
+
+def _linear(z, out):
+    np.copyto(out, z)
+
+
+def _linear_grad(z, a, out):
+    out.fill(1.0)
+
+
+# name -> (activation(z, out), derivative(z, a, out)); 'linear' is the pages' default (no activationFn)
+ACTIVATIONS = {
+    'linear': (_linear, _linear_grad),
+    'relu': (_relu, _relu_grad),
+    'sigmoid': (_sigmoid, _sigmoid_grad),
+}
+
+
+def softmax_rows(z, out):
+    """Row-wise softmax of z into out, shifting each row by its own max."""
+    np.subtract(z, z.max(axis=1, keepdims=True), out=out)
+    np.exp(out, out=out)
+    out /= out.sum(axis=1, keepdims=True)
+    return out
+
+
+class MLP:
+    """Fully connected network evaluated on (batch, features) arrays.
+
+    weights[l] is layer l's (outputs, inputs) matrix and biases[l] its
+    outputs-long vector (None, or a missing layer, means zeros). activation
+    is a key of ACTIVATIONS and, as in calculate-activations.ts, applies to
+    every layer including the output.
+    """
+
+    def __init__(self, weights, biases=None, activation='linear', dtype=np.float64):
+        if activation not in ACTIVATIONS:
+            raise ValueError(f"activation must be one of {', '.join(ACTIVATIONS)}")
+        self.dtype = np.dtype(dtype)
+        self.weights = [np.array(W, dtype=self.dtype) for W in weights]
+        self.sizes = [self.weights[0].shape[1]] + [W.shape[0] for W in self.weights]
+        for l, W in enumerate(self.weights):
+            if W.ndim != 2 or W.shape[1] != self.sizes[l]:
+                raise ValueError(f"layer {l} weights have shape {W.shape}, expected (n, {self.sizes[l]})")
+        biases = biases or []
+        self.biases = [np.array(biases[l], dtype=self.dtype) if l < len(biases) and biases[l] is not None
+                       else np.zeros(W.shape[0], dtype=self.dtype) for l, W in enumerate(self.weights)]
+        for l, (W, b) in enumerate(zip(self.weights, self.biases)):
+            if b.shape != (W.shape[0],):
+                raise ValueError(f"layer {l} biases have shape {b.shape}, expected ({W.shape[0]},)")
+        self.activation = activation
+        self._activate, self._activate_grad = ACTIVATIONS[activation]
+
+        self.grad_weights = [np.zeros_like(W) for W in self.weights]
+        self.grad_biases = [np.zeros_like(b) for b in self.biases]
+        self._capacity = 0
+        self._buffers = None
+
+    def _buffers_for(self, n):
+        # Reallocated only when a batch is larger than any before; smaller batches use leading rows
+        if n > self._capacity:
+            def layers():
+                return [np.empty((n, size), dtype=self.dtype) for size in self.sizes[1:]]
+            self._buffers = {
+                'z': layers(),          # Pre-activations
+                'a': layers(),          # Activations
+                'delta': layers(),      # dLoss/dz
+                'scratch': layers(),    # Activation derivatives
+                'probs': np.empty((n, self.sizes[-1]), dtype=self.dtype),
+            }
+            self._capacity = n
+        return {name: [buf[:n] for buf in bufs] if isinstance(bufs, list) else bufs[:n]
+                for name, bufs in self._buffers.items()}
+
+    def _as_batch(self, inputs):
+        inputs = np.asarray(inputs, dtype=self.dtype)
+        if inputs.ndim == 1:
+            inputs = inputs[np.newaxis]
+        if inputs.ndim != 2 or inputs.shape[1] != self.sizes[0]:
+            raise ValueError(f"inputs have shape {inputs.shape}, expected (batch, {self.sizes[0]})")
+        return inputs
+
+    def forward(self, inputs):
+        """Activations of every layer for (batch, inputs) rows, the inputs first.
+
+        The layers after the inputs are views of internal buffers, overwritten
+        by the next call; copy them (or use activation_table) to keep them.
+        """
+        inputs = self._as_batch(inputs)
+        buffers = self._buffers_for(inputs.shape[0])
+        a = inputs
+        for W, b, z, out in zip(self.weights, self.biases, buffers['z'], buffers['a']):
+            np.matmul(a, W.T, out=z)
+            z += b
+            self._activate(z, out)
+            a = out
+        return [inputs] + buffers['a']
+
+    def backward(self, inputs, labels):
+        """Mean softmax cross-entropy over the batch and its gradients, in one pass.
+
+        The softmax reads the last layer's pre-activations (the logits), so
+        the output activation doesn't enter the loss. labels are class
+        indices, or one-hot/probability rows. Returns (loss, grad_weights,
+        grad_biases); the gradient arrays are reused by the next call.
+        """
+        activations = self.forward(inputs)
+        n = activations[0].shape[0]
+        buffers = self._buffers_for(n)
+        logits, probs, delta = buffers['z'][-1], buffers['probs'], buffers['delta'][-1]
+
+        # Cross-entropy from log-sum-exp of the shifted logits, so no log of a rounded-to-zero probability
+        np.subtract(logits, logits.max(axis=1, keepdims=True), out=probs)
+        labels = np.asarray(labels)
+        if labels.ndim == 1:
+            picked = probs[np.arange(n), labels]
+            weight = 1.0
+        else:
+            picked = np.einsum('ij,ij->i', labels, probs)
+            weight = labels.sum(axis=1)
+        np.exp(probs, out=probs)
+        sums = probs.sum(axis=1)
+        loss = float(np.mean(np.log(sums) * weight - picked))
+        probs /= sums[:, np.newaxis]
+
+        # dLoss/dlogits = (softmax - target) / n
+        np.copyto(delta, probs)
+        if labels.ndim == 1:
+            delta[np.arange(n), labels] -= 1.0
+        else:
+            delta -= labels
+        delta /= n
+
+        for l in range(len(self.weights) - 1, -1, -1):
+            delta = buffers['delta'][l]
+            np.matmul(delta.T, activations[l], out=self.grad_weights[l])
+            np.sum(delta, axis=0, out=self.grad_biases[l])
+            if l:
+                previous = buffers['delta'][l - 1]
+                np.matmul(delta, self.weights[l], out=previous)
+                self._activate_grad(buffers['z'][l - 1], activations[l], buffers['scratch'][l - 1])
+                previous *= buffers['scratch'][l - 1]
+        return loss, self.grad_weights, self.grad_biases
+
+    def train_step(self, inputs, labels, learning_rate=0.1):
+        """One gradient descent step on a batch; returns the loss before the step."""
+        loss, grad_weights, grad_biases = self.backward(inputs, labels)
+        for W, b, dW, db in zip(self.weights, self.biases, grad_weights, grad_biases):
+            W -= learning_rate * dW
+            b -= learning_rate * db
+        return loss
+
+    def predict(self, inputs):
+        """Class probabilities (softmax of the logits) for each row, as a new array."""
+        n = self.forward(inputs)[0].shape[0]
+        buffers = self._buffers_for(n)
+        return softmax_rows(buffers['z'][-1], buffers['probs']).copy()
+
+
+def activation_table(weights, inputs, biases=None, activation='linear'):
+    """Every layer's activations for many inputs at once: a list of (n_inputs, layer size) arrays.
+
+    Row i of the table is what calculateActivations(inputs[i], weights,
+    biases, activationFn) returns for one input.
+    """
+    return [layer.copy() for layer in MLP(weights, biases, activation).forward(inputs)]
+
+
+def table_rows(table, decimals=None):
+    """Per-input nested lists, in the shape of the pages' `activations` prop."""
+    if decimals is not None:
+        table = [np.round(layer, decimals) for layer in table]
+    return [[layer[i].tolist() for layer in table] for i in range(table[0].shape[0])]
+
+
+# Per-sample references for the benchmark: nn.py's column vectors and the pages' scalar loop
+
+PER_SAMPLE_ACTIVATIONS = {
+    'linear': lambda z: z,
+    'relu': lambda z: np.maximum(z, 0.0),
+    'sigmoid': sigma,
+}
+
+
+def forward_per_sample(weights, biases, inputs, activation='linear'):
+    """Like MLP.forward, one column vector at a time as in nn.py."""
+    activate = PER_SAMPLE_ACTIVATIONS[activation]
+    weights = [np.asarray(W, dtype=float) for W in weights]
+    biases = [np.asarray(b, dtype=float).reshape(-1, 1) for b in biases]
+    table = [[] for _ in range(len(weights) + 1)]
+    for x in inputs:
+        a = np.asarray(x, dtype=float).reshape(-1, 1)
+        table[0].append(a[:, 0])
+        for l, (W, b) in enumerate(zip(weights, biases)):
+            a = activate(W @ a + b)
+            table[l + 1].append(a[:, 0])
+    return [np.array(layer) for layer in table]
+
+
+def backward_per_sample(weights, biases, inputs, labels, activation='linear'):
+    """Mean cross-entropy and gradients, accumulated one sample at a time with nn.softmax."""
+    activate = PER_SAMPLE_ACTIVATIONS[activation]
+    weights = [np.asarray(W, dtype=float) for W in weights]
+    biases = [np.asarray(b, dtype=float).reshape(-1, 1) for b in biases]
+    grad_weights = [np.zeros_like(W) for W in weights]
+    grad_biases = [np.zeros_like(b) for b in biases]
+    total = 0.0
+    for x, label in zip(inputs, labels):
+        a = np.asarray(x, dtype=float).reshape(-1, 1)
+        activations, zs = [a], []
+        for W, b in zip(weights, biases):
+            z = W @ a + b
+            zs.append(z)
+            a = activate(z)
+            activations.append(a)
+        s = softmax(zs[-1])
+        total -= np.log(s[label, 0])
+        delta = s
+        delta[label] -= 1.0
+        for l in range(len(weights) - 1, -1, -1):
+            grad_weights[l] += delta @ activations[l].T
+            grad_biases[l] += delta
+            if l:
+                a = activations[l]
+                derivative = {'linear': 1.0, 'relu': zs[l - 1] > 0, 'sigmoid': a * (1 - a)}[activation]
+                delta = (weights[l].T @ delta) * derivative
+    n = len(inputs)
+    return total / n, [g / n for g in grad_weights], [g[:, 0] / n for g in grad_biases]
+
+
+def calculate_activations(input_data, weights, biases=None, activation_fn=None):
+    """Line-by-line port of calculateActivations from modules/nn/calculate-activations.ts."""
+    previous = list(input_data)
+    activations = [previous]
+    for layer in range(len(weights)):
+        outputs = []
+        for neuron in range(len(weights[layer])):
+            activation = 0.0
+            for i in range(len(previous)):
+                activation += previous[i] * weights[layer][neuron][i]
+            if biases and biases[layer] is not None:
+                activation += biases[layer][neuron]
+            outputs.append(activation_fn(activation) if activation_fn else activation)
+        activations.append(outputs)
+        previous = outputs
+    return activations
+
+
+def _best_time(fn, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark(n_samples=2000, repeats=3, seed=0):
+    """Time the batched engine against the per-sample loops and check they agree."""
+    rng = np.random.default_rng(seed)
+    networks = {
+        '4-5-3-7 (weights4537)': [4, 5, 3, 7],
+        '64-128-128-10': [64, 128, 128, 10],
+    }
+    scalar_samples = min(n_samples, 200)  # The pure-Python triple loop is too slow for more
+    print(f"{'network':<24}{'activation':<12}{'method':<24}{'us/sample':>12}{'speedup':>10}")
+    for name, sizes in networks.items():
+        weights = [rng.uniform(-1, 1, (n_out, n_in)) * np.sqrt(3 / n_in) for n_in, n_out in zip(sizes, sizes[1:])]
+        biases = [rng.uniform(-0.1, 0.1, n_out) for n_out in sizes[1:]]
+        inputs = rng.uniform(-2, 2, (n_samples, sizes[0]))
+        labels = rng.integers(0, sizes[-1], n_samples)
+        for activation in ('relu', 'sigmoid'):
+            mlp = MLP(weights, biases, activation)
+            batched = activation_table(weights, inputs, biases, activation)
+            looped = forward_per_sample(weights, biases, inputs, activation)
+            loss, grad_weights, _ = mlp.backward(inputs, labels)
+            loop_loss, loop_grad_weights, _ = backward_per_sample(weights, biases, inputs, labels, activation)
+            assert all(np.allclose(x, y) for x, y in zip(batched, looped)), "forward passes disagree"
+            assert np.isclose(loss, loop_loss), "losses disagree"
+            assert all(np.allclose(x, y) for x, y in zip(grad_weights, loop_grad_weights)), "gradients disagree"
+
+            activation_fn = {'relu': lambda x: max(0.0, x), 'sigmoid': lambda x: 1 / (1 + np.exp(-x))}[activation]
+            w_lists, b_lists = [W.tolist() for W in weights], [b.tolist() for b in biases]
+            timings = [
+                ('forward, scalar loop', scalar_samples, _best_time(
+                    lambda: [calculate_activations(x, w_lists, b_lists, activation_fn)
+                             for x in inputs[:scalar_samples].tolist()], 1)),
+                ('forward, per sample', n_samples, _best_time(
+                    lambda: forward_per_sample(weights, biases, inputs, activation), repeats)),
+                ('forward, batched', n_samples, _best_time(lambda: mlp.forward(inputs), repeats)),
+                ('backward, per sample', n_samples, _best_time(
+                    lambda: backward_per_sample(weights, biases, inputs, labels, activation), repeats)),
+                ('backward, batched', n_samples, _best_time(lambda: mlp.backward(inputs, labels), repeats)),
+            ]
+            per_sample = {method: seconds / samples * 1e6 for method, samples, seconds in timings}
+            for method, _, _ in timings:
+                reference = per_sample[method.split(',')[0] + ', per sample']
+                print(f"{name:<24}{activation:<12}{method:<24}{per_sample[method]:>12.2f}"
+                      f"{reference / per_sample[method]:>9.3g}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    table_parser = commands.add_parser('table', help='activation table for many random inputs')
+    table_parser.add_argument('weights', help='weights JSON as generate_weights.py --json writes: a list of (outputs, inputs) '
+                                              'matrices, or {"weights", "biases"} when it was run with --biases')
+    table_parser.add_argument('--biases', help='JSON list of per-layer bias vectors (overrides biases in the weights file)')
+    table_parser.add_argument('--activation', choices=sorted(ACTIVATIONS), default='linear')
+    table_parser.add_argument('--samples', type=int, default=1000)
+    table_parser.add_argument('--low', type=float, default=-5.0)
+    table_parser.add_argument('--high', type=float, default=5.0)
+    table_parser.add_argument('--integers', action='store_true', help='round inputs, like inputNumberType="int"')
+    table_parser.add_argument('--decimals', type=int, default=4)
+    table_parser.add_argument('--seed', type=int, default=0)
+    table_parser.add_argument('--output', help='write the table as JSON here instead of printing a summary')
+    bench_parser = commands.add_parser('benchmark', help='batched engine vs the per-sample loops')
+    bench_parser.add_argument('--samples', type=int, default=2000)
+    bench_parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.command == 'table':
+        with open(args.weights) as f:
+            weights = json.load(f)
+        biases = None
+        if isinstance(weights, dict):
+            weights, biases = weights['weights'], weights.get('biases')
+        if args.biases:
+            with open(args.biases) as f:
+                biases = json.load(f)
+        rng = np.random.default_rng(args.seed)
+        inputs = rng.uniform(args.low, args.high, (args.samples, len(weights[0][0])))
+        if args.integers:
+            inputs = np.round(inputs)
+        start = time.perf_counter()
+        table = activation_table(weights, inputs, biases, args.activation)
+        elapsed = time.perf_counter() - start
+        print(f"{args.samples} inputs through layers {[layer.shape[1] for layer in table]} "
+              f"({args.activation}) in {elapsed * 1000:.2f} ms")
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(table_rows(table, args.decimals), f)
+            print(f"Wrote {args.output}")
+    else:
+        benchmark(args.samples, args.repeats)
@@ -11,23 +11,25 @@ def sigma(x):
   return 1 / (1 + np.exp(-x))
 
 def softmax(x):
-  e = np.exp(x - np.max(x))  # stability trick
-  return e / np.sum(e)
+  # Columns are samples: take the max and the sum per column, not over the whole array
+  e = np.exp(x - np.max(x, axis=0, keepdims=True))  # stability trick
+  return e / np.sum(e, axis=0, keepdims=True)
 
 def loss(y_pred, y_true):
   return -np.sum(y_true * np.log(y_pred + 1e-9))  # cross-entropy
 
-z = W @ a + b
-h = sigma(z)
-s = softmax(h)
+if __name__ == '__main__':
+  z = W @ a + b
+  h = sigma(z)
+  s = softmax(h)
 
-# Suppose true class is the 4th one (one-hot encoded)
-y_true = np.array([[0], [0], [0], [1]])
+  # Suppose true class is the 4th one (one-hot encoded)
+  y_true = np.array([[0], [0], [0], [1]])
 
-print("z =", z)
-print("h =", h)
-print("s =", s)
-print("loss =", loss(s, y_true))
+  print("z =", z)
+  print("h =", h)
+  print("s =", s)
+  print("loss =", loss(s, y_true))
 
-for v in softmax(np.array([18, 17, 0])):
-    print(v)
+  for v in softmax(np.array([18, 17, 0])):
+      print(v)
@@ -1,31 +1,195 @@
-import numpy as np
+"""Generate MLP weights for the nn pages as a compact binary file (optionally also JSON).
+
+Binary layout, all little-endian (read by weights-binary.ts):
+
+    header   magic b'MLPW', version u16, dtype u16 (1 = float16, 2 = float32),
+             n_layers u32, flags u32 (bit 0: biases present)
+    sizes    (n_layers + 1) u32 neuron counts, inputs first
+    table    (offset u32, length u32) per tensor: W1, [b1], W2, [b2], ...
+    blobs    each tensor row-major, starting on a 16-byte boundary
+
+Weight matrices are (outputs, inputs) like weights.ts, so a float32 blob
+can be wrapped in a Float32Array without copying or parsing. float16 halves
+the file; the loader widens it to float32 once.
+
+The optional --json debug output is a list of weight matrices, or a
+{"weights", "biases"} object when --biases is set; nn-ex/mlp.py table
+reads both.
+
+Usage:
+    python generate_weights.py --layers 4 5 3 7 --seed 0 [--dtype float16] [--biases]
+                               [--output weights.bin] [--json weights.json]
+"""
+import argparse
 import json
+import os
+import struct
+import time
+
+import numpy as np
+
+MAGIC = b'MLPW'
+VERSION = 1
+HEADER = struct.Struct('<4sHHII')
+DTYPES = {1: np.dtype('<f2'), 2: np.dtype('<f4')}
+DTYPE_CODES = {'float16': 1, 'float32': 2}
+FLAG_BIASES = 1
+ALIGNMENT = 16
 
-def xavier_uniform(shape):
+
+def xavier_uniform(shape, rng=np.random):
     fan_in, fan_out = shape[1], shape[0]
     limit = np.sqrt(6 / (fan_in + fan_out))
-    return np.random.uniform(-limit, limit, size=shape)
+    return rng.uniform(-limit, limit, size=shape)
+
+
+def he_uniform(shape, rng=np.random):
+    limit = np.sqrt(6 / shape[1])
+    return rng.uniform(-limit, limit, size=shape)
+
+
+INITIALIZERS = {'xavier': xavier_uniform, 'he': he_uniform}
+
 
 def round_array(arr, precision=2):
     """Round a NumPy array to fixed precision and convert to nested lists."""
     return np.round(arr, precision).tolist()
 
-# Define shapes
-shapes = [
-    (5, 4),  # W1
-    (3, 5),  # W2
-    (7, 3)   # W3
-]
 
-# Initialize weights and round them
-weights = [round_array(xavier_uniform(shape), precision=4) for shape in shapes]
+def generate(sizes, seed=0, init='xavier', biases=False):
+    """Weights (and zero biases) for a network with the given neuron counts, inputs first.
+
+    Each layer draws from its own seeded stream, so adding a layer leaves
+    the earlier layers' weights unchanged.
+    """
+    weights, bias_vectors = [], []
+    for layer, (n_in, n_out) in enumerate(zip(sizes, sizes[1:])):
+        rng = np.random.default_rng([seed, layer])
+        weights.append(INITIALIZERS[init]((n_out, n_in), rng))
+        if biases:
+            bias_vectors.append(np.zeros(n_out))
+    return weights, bias_vectors
+
+
+def _align(offset):
+    return offset + (-offset % ALIGNMENT)
+
+
+def encode(sizes, weights, biases=(), dtype='float32'):
+    """The binary file contents for weights and optional biases."""
+    storage = DTYPES[DTYPE_CODES[dtype]]
+    tensors = []
+    for layer, W in enumerate(weights):
+        tensors.append(W)
+        if biases:
+            tensors.append(biases[layer])
+
+    table_offset = HEADER.size + 4 * len(sizes)
+    offset = _align(table_offset + 8 * len(tensors))
+    table, blobs = [], []
+    for tensor in tensors:
+        blob = np.ascontiguousarray(tensor, dtype=storage).tobytes()
+        table.append((offset, tensor.size))
+        blobs.append((offset, blob))
+        offset = _align(offset + len(blob))
+    if offset >= 2 ** 32:
+        raise ValueError(f"{offset} bytes is more than the format's u32 offsets can address")
+
+    out = bytearray(offset)
+    HEADER.pack_into(out, 0, MAGIC, VERSION, DTYPE_CODES[dtype], len(weights), FLAG_BIASES if biases else 0)
+    struct.pack_into(f'<{len(sizes)}I', out, HEADER.size, *sizes)
+    for i, entry in enumerate(table):
+        struct.pack_into('<II', out, table_offset + 8 * i, *entry)
+    for start, blob in blobs:
+        out[start:start + len(blob)] = blob
+    # Trim the padding after the last blob
+    return bytes(out[:blobs[-1][0] + len(blobs[-1][1])])
+
+
+def decode(data):
+    """(sizes, weights, biases) from binary file contents; float32 weights are views into data."""
+    magic, version, dtype_code, n_layers, flags = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError("not a weights file (bad magic)")
+    if version != VERSION:
+        raise ValueError(f"weights file version {version}, expected {VERSION}")
+    if dtype_code not in DTYPES:
+        raise ValueError(f"unknown dtype code {dtype_code}")
+    sizes = list(struct.unpack_from(f'<{n_layers + 1}I', data, HEADER.size))
+    has_biases = bool(flags & FLAG_BIASES)
+    n_tensors = n_layers * (2 if has_biases else 1)
+    table = struct.unpack_from(f'<{2 * n_tensors}I', data, HEADER.size + 4 * len(sizes))
+
+    tensors = [np.frombuffer(data, dtype=DTYPES[dtype_code], count=length, offset=offset)
+               for offset, length in zip(table[::2], table[1::2])]
+    step = 2 if has_biases else 1
+    weights = [tensors[i].reshape(n_out, n_in)
+               for i, (n_in, n_out) in zip(range(0, n_tensors, step), zip(sizes, sizes[1:]))]
+    biases = tensors[1::2] if has_biases else []
+    return sizes, weights, biases
+
+
+def to_json(weights, biases=(), decimals=None):
+    """The debug JSON: a list of weight matrices, or {"weights", "biases"} when there are biases."""
+    convert = (lambda a: round_array(a, decimals)) if decimals is not None else (lambda a: a.tolist())
+    data = [convert(W) for W in weights]
+    if biases:
+        data = {'weights': data, 'biases': [convert(b) for b in biases]}
+    return json.dumps(data, indent=2)
+
+
+def from_json(text):
+    """Weight matrices from the debug JSON."""
+    data = json.loads(text)
+    return [np.array(W) for W in (data['weights'] if isinstance(data, dict) else data)]
+
+
+def _best_time(fn, repeats=5):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def report(binary, json_text, weights, dtype):
+    """Print size, load time and precision of the binary and JSON encodings."""
+    formats = [(f'binary ({dtype})', len(binary), lambda: decode(binary)[1]),
+               ('JSON', len(json_text.encode('utf-8')), lambda: from_json(json_text))]
+    print(f"{sum(W.size for W in weights)} weights")
+    for name, size, load in formats:
+        error = max(float(np.max(np.abs(np.asarray(loaded, dtype=np.float64) - W)))
+                    for loaded, W in zip(load(), weights))
+        print(f"  {name:<17}{size / 1024:10.1f} KB   load {_best_time(load) * 1000:8.3f} ms   max error {error:.2e}")
+
 
-# Dump to JSON string with indentation
-json_output = json.dumps(weights, indent=2)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--layers', type=int, nargs='+', default=[4, 5, 3, 7],
+                        help='neuron counts, inputs first (default: 4 5 3 7, the weights4537 shapes)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--init', choices=sorted(INITIALIZERS), default='xavier')
+    parser.add_argument('--biases', action='store_true', help='also write zero-initialized bias vectors')
+    parser.add_argument('--dtype', choices=sorted(DTYPE_CODES), default='float32')
+    parser.add_argument('--output', default='weights.bin')
+    parser.add_argument('--json', help='also write the weights as indented JSON (for debugging, and for nn-ex/mlp.py table)')
+    parser.add_argument('--json-decimals', type=int, help='round the JSON weights to this many decimals')
+    args = parser.parse_args()
+    if len(args.layers) < 2 or min(args.layers) < 1:
+        parser.error('--layers needs at least two positive neuron counts')
 
-# Optionally save to file
-with open("weights.json", "w") as f:
-    f.write(json_output)
+    weights, biases = generate(args.layers, args.seed, args.init, args.biases)
+    binary = encode(args.layers, weights, biases, args.dtype)
+    tmp_path = f"{args.output}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(binary)
+    os.replace(tmp_path, args.output)
+    print(f"Wrote {args.output}: layers {args.layers}, seed {args.seed}, {args.init} init, {args.dtype}")
 
-# Print JSON to console
-print(json_output)
+    json_text = to_json(weights, biases, args.json_decimals)
+    if args.json:
+        with open(args.json, 'w') as f:
+            f.write(json_text)
+        print(f"Wrote {args.json}")
+    report(binary, json_text, weights, args.dtype)
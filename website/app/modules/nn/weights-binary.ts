@@ -0,0 +1,106 @@
+// Loader for the binary weight files written by generate_weights.py (see its
+// docstring for the layout). float32 tensors are Float32Array views into the
+// fetched buffer, so nothing is parsed or copied; float16 tensors are widened
+// to float32 once.
+
+const MAGIC = "MLPW";
+const VERSION = 1;
+const HEADER_BYTES = 16;
+const DTYPE_FLOAT16 = 1;
+const DTYPE_FLOAT32 = 2;
+const FLAG_BIASES = 1;
+
+// Typed arrays use the platform's byte order; the file is little-endian
+const LITTLE_ENDIAN = new Uint8Array(new Uint16Array([1]).buffer)[0] === 1;
+
+export type BinaryWeights = {
+  // Neuron counts per layer, inputs first (the pages' neuronCounts)
+  sizes: number[];
+  // Layer l is a row-major (sizes[l + 1], sizes[l]) matrix, like weights.ts
+  weights: Float32Array[];
+  biases?: Float32Array[];
+};
+
+function halfToFloat(bits: number): number {
+  const sign = bits & 0x8000 ? -1 : 1;
+  const exponent = (bits >> 10) & 0x1f;
+  const fraction = bits & 0x3ff;
+  if (exponent === 0) return sign * Math.pow(2, -14) * (fraction / 1024);
+  if (exponent === 0x1f) return fraction ? NaN : sign * Infinity;
+  return sign * Math.pow(2, exponent - 15) * (1 + fraction / 1024);
+}
+
+function readTensor(
+  buffer: ArrayBuffer,
+  view: DataView,
+  dtype: number,
+  offset: number,
+  length: number
+): Float32Array {
+  if (dtype === DTYPE_FLOAT32) {
+    if (LITTLE_ENDIAN) return new Float32Array(buffer, offset, length);
+    const out = new Float32Array(length);
+    for (let i = 0; i < length; i++) out[i] = view.getFloat32(offset + 4 * i, true);
+    return out;
+  }
+  const out = new Float32Array(length);
+  for (let i = 0; i < length; i++) out[i] = halfToFloat(view.getUint16(offset + 2 * i, true));
+  return out;
+}
+
+export function parseWeights(buffer: ArrayBuffer): BinaryWeights {
+  const view = new DataView(buffer);
+  const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+  if (magic !== MAGIC) throw new Error("Not a weights file (bad magic)");
+  const version = view.getUint16(4, true);
+  if (version !== VERSION) {
+    throw new Error(`Weights file version ${version}, expected ${VERSION}`);
+  }
+  const dtype = view.getUint16(6, true);
+  if (dtype !== DTYPE_FLOAT16 && dtype !== DTYPE_FLOAT32) {
+    throw new Error(`Unknown weights dtype code ${dtype}`);
+  }
+  const nLayers = view.getUint32(8, true);
+  const hasBiases = (view.getUint32(12, true) & FLAG_BIASES) !== 0;
+
+  const sizes: number[] = [];
+  for (let i = 0; i <= nLayers; i++) sizes.push(view.getUint32(HEADER_BYTES + 4 * i, true));
+  const tableStart = HEADER_BYTES + 4 * sizes.length;
+  const tensors: Float32Array[] = [];
+  const nTensors = nLayers * (hasBiases ? 2 : 1);
+  for (let i = 0; i < nTensors; i++) {
+    const offset = view.getUint32(tableStart + 8 * i, true);
+    const length = view.getUint32(tableStart + 8 * i + 4, true);
+    tensors.push(readTensor(buffer, view, dtype, offset, length));
+  }
+
+  if (!hasBiases) return { sizes, weights: tensors };
+  return {
+    sizes,
+    weights: tensors.filter((_, i) => i % 2 === 0),
+    biases: tensors.filter((_, i) => i % 2 === 1),
+  };
+}
+
+export async function fetchWeights(url: string): Promise<BinaryWeights> {
+  const response = await fetch(url);
+  if (!response.ok) throw new Error(`Could not load ${url}: ${response.status}`);
+  return parseWeights(await response.arrayBuffer());
+}
+
+// Nested number[][][] (and number[][] biases) for MlpSvg and calculateActivations
+export function toNestedWeights(binary: BinaryWeights): {
+  weights: number[][][];
+  biases?: number[][];
+} {
+  const weights = binary.weights.map((matrix, layer) => {
+    const nIn = binary.sizes[layer];
+    const rows: number[][] = [];
+    for (let row = 0; row < binary.sizes[layer + 1]; row++) {
+      rows.push(Array.from(matrix.subarray(row * nIn, (row + 1) * nIn)));
+    }
+    return rows;
+  });
+  const biases = binary.biases?.map((bias) => Array.from(bias));
+  return biases ? { weights, biases } : { weights };
+}
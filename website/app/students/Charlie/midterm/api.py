@@ -1,102 +1,649 @@
 import torch
 import numpy as np
 import os
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
-import tempfile
 import base64
+import cProfile
+import pstats
 import sys
+import threading
+import time
+import argparse
+import contextlib
+import hmac
+import io
+import json
+import math
+import zipfile
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 # Add the current directory to Python path to import generate.py
 sys.path.append(os.path.dirname(__file__))
-from generate import generate_single, mel_to_midi, evaluate_sequence_quality, temperature_for_attempt
+from generate import (
+    generate_batch, iter_rollout, mel_to_midi, midi_to_bytes, evaluate_sequence_quality, temperature_for_attempt, METADATA_CSV,
+    CORPUS_PATH, successive_halving, configure_torch_threads, Deadline, DeadlineExceeded
+)
+from seed_pool import get_seed_pool
+from serving import InferenceServer, ServerBusy
+from cache import ResponseCache
+from patterns import DEFAULT_PATTERNS_PATH, load_pattern_library
+from chord_decoder import ChordDecoder
+from metrics import REGISTRY, HTTP_REQUESTS, HTTP_REQUEST_SECONDS, MODEL_LOAD_SECONDS, GENERATIONS_TRUNCATED, timed
+from quantize import PRECISIONS
+from registry import ModelNotLoaded, ModelRegistry
+
+try:
+    from waitress import serve
+except ImportError:
+    serve = None
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for frontend communication
 
 # Use the same paths as in generate.py
-CHECKPOINT_PATH = os.path.join(os.path.dirname(__file__), 'checkpoints', 'mtsf_model_full.pt')
+CHECKPOINT_DIR = os.path.join(os.path.dirname(__file__), 'checkpoints')
+CHECKPOINT_PATH = os.path.join(CHECKPOINT_DIR, 'mtsf_model_full.pt')
 OUTPUT_DIR = os.path.join(os.path.dirname(__file__), 'generated')
 SEED_LENGTH = 100
 TOTAL_LENGTH = 200
 N_ATTEMPTS = 5  # Reduced for API responsiveness
+# Successive halving generates ~30% of the candidate frames of a full best-of-N,
+# so 12 pruned attempts cost about as much as 3-4 full ones
+SEARCH_ATTEMPTS = 12
+SEARCH_MODES = ('halving', 'full')
+REQUEST_TIMEOUT_S = 60
+# Generation stops at max_latency_ms (at most, and by default, REQUEST_TIMEOUT_S) and returns
+# the best candidate so far; the wait for a result allows this much longer before giving up
+DEADLINE_GRACE_S = 5
+MIDI_STREAM_CHUNK = 16 * 1024  # Bytes per chunk for format=stream MIDI exports
+STREAM_FRAMES_PER_CHORD = 12    # Generated frames behind each streamed chord
+MAX_STREAM_CHORDS = 512
+MAX_BATCH_PROGRESSIONS = 10000
+MAX_PROGRESSION_CHORDS = 4096  # Chords per progression in analyze/export requests
+
+# Per-request profiling ({"profile": "cprofile" | "torch"} on /api/generate) is
+# off unless GENERATOR_PROFILING=1; profiled requests run one at a time
+PROFILING_ENABLED = os.environ.get('GENERATOR_PROFILING') == '1'
+PROFILE_ROWS = 30
+profile_lock = threading.Lock()
+
+# Model hot-swap (/api/admin/models) is off unless GENERATOR_ADMIN_TOKEN is set;
+# requests must send it as 'Authorization: Bearer <token>'
+ADMIN_TOKEN = os.environ.get('GENERATOR_ADMIN_TOKEN')
+
+# Pattern library for /api/analyze: the bundled patterns.json plus an optional user
+# file (JAZZ_PATTERNS_FILE) whose entries add to or override the defaults
+PATTERNS_FILE = os.environ.get('JAZZ_PATTERNS_FILE')
+pattern_library = load_pattern_library(DEFAULT_PATTERNS_PATH, PATTERNS_FILE)
+chord_decoder = ChordDecoder()
+
+# Seeded generations and MIDI exports are deterministic, so repeats are served from memory
+generate_cache = ResponseCache(max_entries=256, ttl_s=3600)
+midi_cache = ResponseCache(max_entries=512, ttl_s=3600)
 
-model = None
+# Model versions live in shared memory; requests pin the active one (see registry.py)
+model_registry = ModelRegistry()
+inference_server = None
+# The active version's details, replaced as a whole when a new version is activated
+model_info = {
+    'ready': False,           # True once the warm-up rollout has finished
+    'format': None,           # 'torchscript' or 'eager'
+    'precision': None,        # 'float32', 'int8' or 'bfloat16'
+    'parity': None,           # Parity check summary for reduced precision
+    'version': None,          # Content hash of the checkpoint, part of the generate cache key
+    'torch_threads': None,
+    'load_time_s': None,
+    'warmup_time_s': None,
+}
 
-def load_model():
-    global model
+def load_model(precision='float32', scripted=True):
     try:
-        model = torch.load(CHECKPOINT_PATH, map_location='cpu', weights_only=False)
-        print(f"Model loaded successfully from {CHECKPOINT_PATH}")
+        model_info['torch_threads'] = configure_torch_threads()
+        # Warmed up before activation so the first request doesn't pay for it
+        version = model_registry.load(CHECKPOINT_PATH, precision, scripted=scripted,
+                                      warm_up_candidates=min(N_ATTEMPTS, 3))
+        MODEL_LOAD_SECONDS.set(version.info['load_time_s'], phase='load')
+        MODEL_LOAD_SECONDS.set(version.info['warmup_time_s'], phase='warmup')
+        activate_version(version)
+        print(f"Warm-up rollout finished in {version.info['warmup_time_s']:.3f}s")
         return True
     except Exception as e:
         print(f"Error loading model: {e}")
         return False
 
+def activate_version(version):
+    """Send new requests to version; requests already running finish on the version they pinned."""
+    global model_info
+    if inference_server is not None:
+        # Workers map and warm up the new weights before any request can reach them
+        inference_server.prepare(version)
+    previous = model_registry.activate(version)
+    model_info = dict(model_info, ready=True, **version.info)
+    return previous
+
+def parse_seed(data):
+    """Optional integer 'seed' request field; None when absent."""
+    seed = data.get('seed')
+    if seed is None:
+        return None
+    if isinstance(seed, bool) or not isinstance(seed, int):
+        raise ValueError("'seed' must be an integer")
+    return seed
+
+def parse_temperature(data, default=1.2):
+    """'temperature' request field as a float; default when absent."""
+    temperature = data.get('temperature', default)
+    if isinstance(temperature, bool) or not isinstance(temperature, (int, float)) \
+            or not math.isfinite(temperature) or temperature < 0:
+        raise ValueError("'temperature' must be a non-negative number")
+    return float(temperature)
+
+def parse_length(data, default=8, maximum=None):
+    """'length' request field (chords) as a positive integer, at most maximum; default when absent."""
+    length = data.get('length', default)
+    if isinstance(length, bool) or not isinstance(length, int) or length < 1:
+        raise ValueError("'length' must be a positive integer")
+    if maximum is not None and length > maximum:
+        raise ValueError(f"'length' must be between 1 and {maximum}")
+    return length
+
+def parse_max_latency(data):
+    """Generation budget in seconds from the optional 'max_latency_ms' field, capped at REQUEST_TIMEOUT_S."""
+    max_latency_ms = data.get('max_latency_ms')
+    if max_latency_ms is None:
+        return REQUEST_TIMEOUT_S
+    if isinstance(max_latency_ms, bool) or not isinstance(max_latency_ms, (int, float)) or max_latency_ms <= 0:
+        raise ValueError("'max_latency_ms' must be a positive number")
+    return min(max_latency_ms / 1000.0, REQUEST_TIMEOUT_S)
+
+def generation_timeout(deadline):
+    """Seconds to wait for a generation result: the deadline's budget plus a grace period.
+
+    Results normally arrive by the deadline; the timeout only catches a stuck rollout.
+    """
+    if deadline is None or deadline.budget_s is None:
+        return REQUEST_TIMEOUT_S
+    return deadline.budget_s + DEADLINE_GRACE_S
+
+def start_inference_server(workers=1, max_pending=32, batch_window_ms=5.0):
+    """Put rollouts behind a micro-batching InferenceServer (see serving.py)."""
+    global inference_server
+    inference_server = InferenceServer(
+        model_registry.current,
+        workers=workers,
+        max_pending=max_pending,
+        batch_window_ms=batch_window_ms,
+    ).start()
+    print(f"Inference server started: {inference_server.mode} mode, {inference_server.workers} worker(s), "
+          f"max {max_pending} pending requests")
+    return inference_server
+
+@contextlib.contextmanager
+def profiled(kind):
+    """Profile the enclosed block with cProfile or torch.profiler; the report lands in the yielded dict."""
+    report = {}
+    if kind == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield report
+        finally:
+            profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(PROFILE_ROWS)
+            report['cprofile'] = out.getvalue()
+    elif kind == 'torch':
+        with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU]) as profiler:
+            yield report
+        report['torch'] = profiler.key_averages().table(sort_by='self_cpu_time_total', row_limit=PROFILE_ROWS)
+    else:
+        raise ValueError("'profile' must be 'cprofile' or 'torch'")
+
+def collect_service_metrics():
+    """Cache, serving and seed pool counters, read at scrape time."""
+    families = []
+    caches = {'generate': generate_cache.describe(), 'midi': midi_cache.describe()}
+    for field, kind in (('hits', 'counter'), ('misses', 'counter'), ('evictions', 'counter'), ('entries', 'gauge')):
+        families.append((f'response_cache_{field}' + ('_total' if kind == 'counter' else ''), kind,
+                         f'Response cache {field}', [({'cache': name}, stats[field]) for name, stats in caches.items()]))
+    if inference_server is not None:
+        stats = inference_server.describe()
+        families.extend([
+            ('inference_requests_total', 'counter', 'Requests admitted by the inference server', [({}, stats['requests'])]),
+            ('inference_rejected_total', 'counter', 'Requests rejected with 503', [({}, stats['rejected'])]),
+            ('inference_expired_total', 'counter', 'Jobs dropped because their deadline passed while queued',
+             [({}, stats['expired'])]),
+            ('inference_batches_total', 'counter', 'Batched rollouts dispatched', [({}, stats['batches'])]),
+            ('inference_queued', 'gauge', 'Jobs waiting for a batch', [({}, stats['queued'])]),
+            ('inference_in_flight', 'gauge', 'Batches currently rolling out', [({}, stats['in_flight'])]),
+        ])
+    pool = get_seed_pool(METADATA_CSV, CORPUS_PATH)
+    families.extend([
+        ('seed_pool_samples_total', 'counter', 'Seed windows read from real data', [({}, pool.samples_served)]),
+        ('seed_pool_fallbacks_total', 'counter', 'Seeds replaced by random noise', [({}, pool.fallbacks)]),
+    ])
+    families.append(('model_ready', 'gauge', '1 once the model is loaded and warm', [({}, int(model_info['ready']))]))
+    models = model_registry.describe()
+    versions = ([models['current']] if models['current'] else []) + models['retiring']
+    families.extend([
+        ('model_swaps_total', 'counter', 'Model versions replaced through the registry', [({}, models['swaps'])]),
+        ('model_requests_in_flight', 'gauge', 'Requests pinned to each loaded model version',
+         [({'version': v['version'], 'precision': v['precision']}, v['in_flight']) for v in versions]),
+    ])
+    return families
+
+REGISTRY.add_collector(collect_service_metrics)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    # Streaming responses are counted when headers go out, not when the body ends
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    HTTP_REQUESTS.inc(endpoint=endpoint, status=str(response.status_code))
+    start = g.get('request_start')
+    if start is not None:
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+    return response
+
+@app.route('/api/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus text exposition of request, stage and rollout metrics."""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
+    serving_ok = inference_server is None or inference_server.healthy
+    if not serving_ok:
+        status = 'unhealthy'
+    else:
+        status = 'healthy' if model_info['ready'] else 'warming_up'
+    body = jsonify({
+        'status': status,
+        'model_loaded': model_registry.current is not None,
+        'model': model_info,
+        'seed_pool': get_seed_pool(METADATA_CSV, CORPUS_PATH).describe(),
+        'patterns': pattern_library.describe(),
+        'serving': inference_server.describe() if inference_server is not None else None,
+        'cache': {
+            'generate': generate_cache.describe(),
+            'midi': midi_cache.describe()
+        }
+    })
+    # A dead dispatcher or broken worker pool can't serve requests; let load balancers see it
+    return body if serving_ok else (body, 503)
+
+def check_admin_token():
+    """None if the request carries the admin token, else the error response to return."""
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Model admin is disabled (start the API with GENERATOR_ADMIN_TOKEN set)'}), 403
+    supplied = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(supplied.encode('utf-8'), f'Bearer {ADMIN_TOKEN}'.encode('utf-8')):
+        return jsonify({'error': 'Invalid admin token'}), 401
+    return None
+
+def resolve_checkpoint(name):
+    """Absolute path of a checkpoint file inside CHECKPOINT_DIR; ValueError for anything else."""
+    root = os.path.realpath(CHECKPOINT_DIR)
+    path = os.path.realpath(os.path.join(root, name))
+    # Checkpoints are pickles, so only files already in the checkpoints directory are loaded
+    if os.path.commonpath([path, root]) != root:
+        raise ValueError("'checkpoint' must name a file in the checkpoints directory")
+    if not os.path.isfile(path):
+        raise ValueError(f"checkpoint {name!r} not found")
+    return path
+
+@app.route('/api/admin/models', methods=['GET'])
+def list_models():
+    """The active model version and any retired ones still finishing requests."""
+    denied = check_admin_token()
+    if denied is not None:
+        return denied
+    return jsonify(model_registry.describe())
+
+@app.route('/api/admin/models', methods=['POST'])
+def swap_model():
+    """Load a checkpoint into shared memory, warm it up and make it the active version.
+
+    Body: {"checkpoint": "<file in checkpoints/>", "precision": "float32" | "int8" | "bfloat16"}
+    (precision defaults to the current one). Requests already running finish
+    on the version they started with; if loading fails the current version
+    stays active.
+    """
+    denied = check_admin_token()
+    if denied is not None:
+        return denied
+    data = request.get_json() or {}
+    precision = data.get('precision', model_info['precision'] or 'float32')
+    if precision not in PRECISIONS:
+        return jsonify({'error': f"'precision' must be one of {', '.join(PRECISIONS)}"}), 400
+    if not isinstance(data.get('checkpoint'), str):
+        return jsonify({'error': "'checkpoint' (a file name in the checkpoints directory) is required"}), 400
+    try:
+        checkpoint_path = resolve_checkpoint(data['checkpoint'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if not model_registry.swap_lock.acquire(blocking=False):
+        return jsonify({'error': 'Another model swap is in progress'}), 409
+    try:
+        start = time.perf_counter()
+        current = model_registry.current
+        version = model_registry.load(checkpoint_path, precision,
+                                      scripted=current.spec.scripted if current is not None else True,
+                                      warm_up_candidates=min(N_ATTEMPTS, 3))
+        previous = activate_version(version)
+    except Exception as e:
+        print(f"Model swap failed: {e}")
+        return jsonify({'error': f"Could not load {data['checkpoint']}: {e}"}), 500
+    finally:
+        model_registry.swap_lock.release()
+    print(f"Swapped model {previous.version if previous else None} -> {version.version} "
+          f"in {time.perf_counter() - start:.3f}s")
     return jsonify({
-        'status': 'healthy',
-        'model_loaded': model is not None
+        'success': True,
+        'model': version.describe(),
+        'previous': previous.describe() if previous is not None else None,
+        'swap_time_s': time.perf_counter() - start,
     })
 
 @app.route('/api/generate', methods=['POST'])
 def generate_progression():
+    deadline = None
     try:
         data = request.get_json()
-        temperature = data.get('temperature', 1.2)
-        length = data.get('length', 8)
         # Note: input_chords is received but not currently used in generation
         # The model generates from scratch using real seed data
         input_chords = data.get('input_chords', [])
-        
-        if not model:
-            return jsonify({'error': 'Model not loaded'}), 500
-        
-        print(f"Generating with temperature: {temperature}, length: {length}")
-        
-        # Generate multiple attempts and select the best one (like in your generate.py)
-        best_sequence = None
-        best_score = -float('inf')
-        
-        for attempt in range(min(N_ATTEMPTS, 3)):  # Limit attempts for API responsiveness
-            attempt_temperature = temperature_for_attempt(attempt) if attempt > 0 else temperature
-            sequence = generate_single(
-                model, 
-                temperature=attempt_temperature, 
-                seed_length=SEED_LENGTH, 
-                total_length=TOTAL_LENGTH
-            )
-            score = evaluate_sequence_quality(sequence)
-            print(f"Attempt {attempt + 1}: temp={attempt_temperature:.1f}, score={score:.3f}")
-            
-            if score > best_score:
-                best_sequence = sequence
-                best_score = score
-        
-        # Convert the generated sequence to chord progression
-        chord_progression = convert_sequence_to_chords(best_sequence, length)
-        
-        print(f"Best sequence score: {best_score:.3f}")
-        
-        return jsonify({
-            'success': True,
-            'chords': chord_progression,
-            'quality_score': float(best_score),
-            'temperature': temperature,
-            'length': length,
-            'sequence_shape': best_sequence.shape
-        })
-        
+        profile = data.get('profile')
+        search = data.get('search', 'halving')
+        try:
+            temperature = parse_temperature(data)
+            length = parse_length(data)
+            seed = parse_seed(data)
+            budget_s = parse_max_latency(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if search not in SEARCH_MODES:
+            return jsonify({'error': "'search' must be 'halving' or 'full'"}), 400
+        if profile is not None:
+            if not PROFILING_ENABLED:
+                return jsonify({'error': 'Profiling is disabled (start the API with GENERATOR_PROFILING=1)'}), 403
+            if profile not in ('cprofile', 'torch'):
+                return jsonify({'error': "'profile' must be 'cprofile' or 'torch'"}), 400
+
+        # The budget counts from here, so time spent queued behind other requests is part of it
+        deadline = Deadline(budget_s)
+
+        # The whole request runs on the version active when it arrived, even across a swap
+        with model_registry.acquire() as version:
+            if profile is not None:
+                # Run inline, bypassing the cache and the batcher, so the profiler sees the whole pipeline
+                with profile_lock, profiled(profile) as report:
+                    result = run_generation(temperature, length, seed, search, use_server=False, version=version,
+                                            deadline=deadline)
+                return jsonify(dict(result, cached=False, profile=report))
+
+            # Only seeded requests are reproducible, so only they are cached
+            cache_key = None
+            if seed is not None:
+                cache_key = (seed, temperature, length, search, version.version, version.precision)
+                cached = generate_cache.get(cache_key)
+                if cached is not None:
+                    return jsonify(dict(cached, cached=True))
+
+            result = run_generation(temperature, length, seed, search, version=version, deadline=deadline)
+            # A truncated result depends on timing, so replays don't get it from the cache
+            if cache_key is not None and not result['truncated']:
+                generate_cache.put(cache_key, result)
+            return jsonify(dict(result, cached=False))
+
+    except ModelNotLoaded:
+        return jsonify({'error': 'Model not loaded'}), 500
+    except DeadlineExceeded as e:
+        return jsonify({'error': f'Generation timed out: {e}', 'truncated': True}), 504
+    except ServerBusy as e:
+        response = jsonify({'error': f'Server busy: {e}'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    except FutureTimeoutError:
+        message = f'Generation timed out after {generation_timeout(deadline):g}s'
+        if data.get('max_latency_ms') is not None:
+            message += f" (max_latency_ms={data['max_latency_ms']})"
+        return jsonify({'error': message}), 504
     except Exception as e:
         print(f"Generation error: {e}")
         return jsonify({'error': str(e)}), 500
+    finally:
+        # However the request ends, stop any rollout still working for it
+        if deadline is not None:
+            deadline.cancel()
+
+def run_generation(temperature, length, seed=None, search='halving', use_server=True, version=None, deadline=None):
+    """Best-of-N rollout, scoring and chord decoding for one /api/generate request.
+
+    search='halving' runs SEARCH_ATTEMPTS candidates with successive halving;
+    search='full' rolls out min(N_ATTEMPTS, 3) candidates to full length.
+    Runs on version, or pins the active model version for the call. When
+    deadline (a generate.Deadline) expires the rollout stops, the best
+    candidate so far is decoded and the result has truncated=True; if no
+    frame was generated by then, DeadlineExceeded is raised.
+    """
+    if version is None:
+        with model_registry.acquire() as version:
+            return run_generation(temperature, length, seed, search, use_server, version, deadline)
+    print(f"Generating with temperature: {temperature}, length: {length}, seed: {seed}, search: {search}")
+
+    # Generate multiple attempts and select the best one (like in your generate.py)
+    n_attempts = SEARCH_ATTEMPTS if search == 'halving' else min(N_ATTEMPTS, 3)
+    attempt_temperatures = [
+        temperature_for_attempt(attempt) if attempt > 0 else temperature
+        for attempt in range(n_attempts)
+    ]
+    server = inference_server if use_server else None
+    timeout = generation_timeout(deadline)
+    if search == 'halving':
+        # Weak attempts are pruned partway; concurrent searches share a batch, each pruning its own
+        if server is not None:
+            best_sequence, best_score, search_info = server.search(
+                attempt_temperatures, seed_length=SEED_LENGTH, total_length=TOTAL_LENGTH, seed=seed,
+                timeout=timeout, version=version, deadline=deadline
+            )
+        else:
+            best_sequence, best_score, search_info = successive_halving(
+                version.model, attempt_temperatures, seed_length=SEED_LENGTH, total_length=TOTAL_LENGTH, seed=seed,
+                deadline=deadline
+            )
+        for attempt, score in zip(search_info['survivors'], search_info['scores']):
+            print(f"Attempt {attempt + 1}: temp={attempt_temperatures[attempt]:.1f}, score={score:.3f} (survived pruning)")
+        search_summary = {
+            'mode': search,
+            'candidates': search_info['candidates'],
+            'survivors': len(search_info['survivors']),
+            'frames_generated': search_info['frames_generated'],
+            'frames_full': search_info['frames_full'],
+        }
+    else:
+        # All attempts share one batched rollout, micro-batched with other requests when serving
+        if server is not None:
+            sequences = server.generate(
+                attempt_temperatures,
+                seed_length=SEED_LENGTH,
+                total_length=TOTAL_LENGTH,
+                seed=seed,
+                timeout=timeout,
+                version=version,
+                deadline=deadline
+            )
+        else:
+            sequences = generate_batch(
+                version.model,
+                attempt_temperatures,
+                seed_length=SEED_LENGTH,
+                total_length=TOTAL_LENGTH,
+                seed=seed,
+                deadline=deadline
+            )
+
+        with timed('score'):
+            scores = evaluate_sequence_quality(sequences)
+
+        for attempt, (attempt_temperature, score) in enumerate(zip(attempt_temperatures, scores)):
+            print(f"Attempt {attempt + 1}: temp={attempt_temperature:.1f}, score={score:.3f}")
+
+        best_index = int(np.argmax(scores))
+        best_sequence = sequences[best_index]
+        best_score = scores[best_index]
+        n_frames = sequences.shape[0] * (sequences.shape[1] - SEED_LENGTH)
+        search_summary = {
+            'mode': search,
+            'candidates': n_attempts,
+            'survivors': n_attempts,
+            'frames_generated': n_frames,
+            'frames_full': n_frames,
+        }
+    
+    truncated = best_sequence.shape[0] < TOTAL_LENGTH
+    if best_sequence.shape[0] <= SEED_LENGTH:
+        raise DeadlineExceeded("no frames were generated before the deadline")
+    if truncated:
+        GENERATIONS_TRUNCATED.inc(endpoint='/api/generate')
+        print(f"Deadline reached after {best_sequence.shape[0] - SEED_LENGTH} of {TOTAL_LENGTH - SEED_LENGTH} frames")
+
+    # Decode the generated frames (not the seed) into the chord progression
+    with timed('decode'):
+        chord_progression = convert_sequence_to_chords(best_sequence[SEED_LENGTH:], length)
+    
+    print(f"Best sequence score: {best_score:.3f}")
+    
+    result = {
+        'success': True,
+        'chords': chord_progression,
+        'quality_score': float(best_score),
+        'temperature': temperature,
+        'length': length,
+        'seed': seed,
+        'search': search_summary,
+        'truncated': truncated,
+        'model_version': version.version,
+        'sequence_shape': list(best_sequence.shape)
+    }
+    return result
+
+def sse_event(event, payload):
+    """Format one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+@app.route('/api/generate/stream', methods=['POST'])
+def generate_progression_stream():
+    """Stream a progression as Server-Sent Events while the rollout runs.
+
+    A single candidate is rolled out (no best-of-N, since chords are sent before
+    the rollout ends). Every STREAM_FRAMES_PER_CHORD new frames are decoded into
+    a 'chord' event, optionally with a base64 MIDI chunk of just those frames
+    ('midi': true). A final 'done' event carries the full progression and its
+    quality score, with truncated=True if max_latency_ms ran out first.
+    """
+    data = request.get_json() or {}
+    include_midi = bool(data.get('midi', False))
+    try:
+        temperature = parse_temperature(data)
+        length = parse_length(data, maximum=MAX_STREAM_CHORDS)
+        seed = parse_seed(data)
+        deadline = Deadline(parse_max_latency(data) if 'max_latency_ms' in data else None)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # The version pin and admission slot outlive this function: they are released when the
+    # stream ends, or when the response is closed without the stream ever starting
+    resources = contextlib.ExitStack()
+    try:
+        # The stream keeps the version it started on, even if a new one is activated midway
+        version = resources.enter_context(model_registry.acquire())
+        # Streams run outside the micro-batcher but still count against its admission limit
+        if inference_server is not None:
+            resources.enter_context(inference_server.slot())
+    except ModelNotLoaded:
+        resources.close()
+        return jsonify({'error': 'Model not loaded'}), 500
+    except ServerBusy as e:
+        resources.close()
+        response = jsonify({'error': f'Server busy: {e}'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+
+    def events():
+        try:
+            start = time.perf_counter()
+            total_length = SEED_LENGTH + length * STREAM_FRAMES_PER_CHORD
+            yield sse_event('start', {
+                'length': length,
+                'temperature': temperature,
+                'seed': seed,
+                'frames_per_chord': STREAM_FRAMES_PER_CHORD
+            })
+
+            chords = []
+            rollout = iter_rollout(version.model, [temperature], seed_length=SEED_LENGTH, total_length=total_length,
+                                   seed=seed, chunk_frames=STREAM_FRAMES_PER_CHORD, deadline=deadline)
+            midi_rng = np.random.RandomState(seed) if seed is not None else None
+            for frames, n_frames in rollout:
+                # The deadline can stop the rollout partway through a chord; that chord is dropped
+                if n_frames <= SEED_LENGTH or (n_frames - SEED_LENGTH) % STREAM_FRAMES_PER_CHORD:
+                    continue
+                window = frames[0, n_frames - STREAM_FRAMES_PER_CHORD:n_frames]
+                # Relative to everything generated so far, as /api/generate decodes the whole rollout
+                with timed('decode'):
+                    chord = convert_sequence_to_chords(window, 1, reference=frames[0, SEED_LENGTH:n_frames])[0]
+                chords.append(chord)
+                event = {
+                    'index': len(chords) - 1,
+                    'chord': chord,
+                    'frame_start': n_frames - STREAM_FRAMES_PER_CHORD,
+                    'frame_end': n_frames,
+                    'elapsed_ms': (time.perf_counter() - start) * 1000
+                }
+                if include_midi:
+                    midi_bytes = midi_to_bytes(mel_to_midi(window.T, tempo=120, rng=midi_rng))
+                    event['midi_data'] = base64.b64encode(midi_bytes).decode('utf-8')
+                yield sse_event('chord', event)
+
+            truncated = len(chords) < length
+            if truncated:
+                GENERATIONS_TRUNCATED.inc(endpoint='/api/generate/stream')
+            yield sse_event('done', {
+                'success': True,
+                'chords': chords,
+                'quality_score': float(evaluate_sequence_quality(frames[0, :n_frames])),
+                'truncated': truncated,
+                'elapsed_ms': (time.perf_counter() - start) * 1000
+            })
+        except Exception as e:
+            print(f"Streaming generation error: {e}")
+            yield sse_event('error', {'error': str(e)})
+        finally:
+            # Also runs when the client disconnects and the generator is closed
+            resources.close()
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # A generator closed before its first next() never runs its finally; closing twice is harmless
+    response.call_on_close(resources.close)
+    return response
 
 @app.route('/api/analyze', methods=['POST'])
 def analyze_progression():
     try:
         data = request.get_json()
         chords = data.get('chords', [])
+        error = validate_chords(chords)
+        if error:
+            return jsonify({'error': error}), 400
         
         # Analyze the chord progression for jazz patterns
         analysis = analyze_jazz_patterns(chords)
@@ -111,36 +658,171 @@ def analyze_progression():
 
 @app.route('/api/export/midi', methods=['POST'])
 def export_midi():
+    """Export chords as MIDI.
+
+    The response format comes from the 'format' field (or ?format=): 'base64'
+    (default, JSON), 'binary' (an audio/midi body) or 'stream' (audio/midi sent
+    in chunks, for long progressions). An 'Accept: audio/midi' header selects
+    'binary' when no format is given.
+    """
     try:
         data = request.get_json()
         chords = data.get('chords', [])
-        
-        # Convert chords to MIDI using your mel_to_midi function
-        # First create a mock mel-spectrogram from chords
-        mock_spectrogram = chords_to_mel_spectrogram(chords)
-        midi_data = mel_to_midi(mock_spectrogram, tempo=120)
-        
-        # Save to temporary file
-        with tempfile.NamedTemporaryFile(suffix='.mid', delete=False) as tmp_file:
-            midi_data.save(tmp_file.name)
-            
-            # Read file and encode as base64
-            with open(tmp_file.name, 'rb') as f:
-                midi_bytes = f.read()
-            
-            os.unlink(tmp_file.name)  # Clean up
-            
+        # Checked before render_midi, whose cache key needs hashable chord symbols
+        error = validate_chords(chords)
+        if error:
+            return jsonify({'error': error}), 400
+        try:
+            seed = parse_seed(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        response_format = data.get('format') or request.args.get('format')
+        if response_format is None:
+            accepts_midi = request.accept_mimetypes.best_match(['application/json', 'audio/midi']) == 'audio/midi'
+            response_format = 'binary' if accepts_midi else 'base64'
+        if response_format not in ('base64', 'binary', 'stream'):
+            return jsonify({'error': "'format' must be 'base64', 'binary' or 'stream'"}), 400
+
+        midi_bytes, cached = render_midi(chords, seed)
+
+        if response_format == 'base64':
             return jsonify({
                 'success': True,
-                'midi_data': base64.b64encode(midi_bytes).decode('utf-8')
+                'midi_data': base64.b64encode(midi_bytes).decode('utf-8'),
+                'cached': cached
             })
-            
+
+        headers = {
+            'Content-Disposition': 'attachment; filename="progression.mid"',
+            'X-Cache': 'hit' if cached else 'miss',
+        }
+        if response_format == 'binary':
+            headers['Content-Length'] = str(len(midi_bytes))
+            return Response(midi_bytes, mimetype='audio/midi', headers=headers)
+
+        def chunks():
+            view = memoryview(midi_bytes)
+            for start in range(0, len(view), MIDI_STREAM_CHUNK):
+                yield bytes(view[start:start + MIDI_STREAM_CHUNK])
+        return Response(chunks(), mimetype='audio/midi', headers=headers)
+
     except Exception as e:
         print(f"MIDI export error: {e}")
         return jsonify({'error': str(e)}), 500
 
-def chords_to_mel_spectrogram(chords):
+@app.route('/api/analyze/batch', methods=['POST'])
+def analyze_progressions_batch():
+    """Analyze many progressions in one request.
+
+    Body: {'progressions': [[chord, ...], ...]}. The response is NDJSON, one
+    {'index', 'analysis'} line per progression, streamed as it is produced.
+    """
+    data = request.get_json() or {}
+    progressions = data.get('progressions', [])
+    error = validate_progressions(progressions)
+    if error:
+        return jsonify({'error': error}), 400
+
+    def lines():
+        for index, chords in enumerate(progressions):
+            yield json.dumps({'index': index, 'analysis': analyze_jazz_patterns(chords)}) + '\n'
+
+    return Response(stream_with_context(lines()), mimetype='application/x-ndjson')
+
+@app.route('/api/export/midi/batch', methods=['POST'])
+def export_midi_batch():
+    """Export many progressions as MIDI in one request.
+
+    Body: {'progressions': [[chord, ...], ...], 'seed': optional int,
+    'format': 'zip' | 'ndjson'}. 'zip' (default) returns an archive of
+    progression_00000.mid, ...; 'ndjson' streams one {'index', 'midi_data'}
+    line per progression with base64 MIDI. Each progression is rendered exactly
+    as /api/export/midi would, sharing its cache.
+    """
+    try:
+        data = request.get_json() or {}
+        progressions = data.get('progressions', [])
+        error = validate_progressions(progressions)
+        if error:
+            return jsonify({'error': error}), 400
+        try:
+            seed = parse_seed(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        response_format = data.get('format') or request.args.get('format') or 'zip'
+        if response_format not in ('zip', 'ndjson'):
+            return jsonify({'error': "'format' must be 'zip' or 'ndjson'"}), 400
+
+        if response_format == 'ndjson':
+            def lines():
+                for index, chords in enumerate(progressions):
+                    midi_bytes, _ = render_midi(chords, seed)
+                    yield json.dumps({
+                        'index': index,
+                        'midi_data': base64.b64encode(midi_bytes).decode('utf-8')
+                    }) + '\n'
+            return Response(stream_with_context(lines()), mimetype='application/x-ndjson')
+
+        buffer = io.BytesIO()
+        # MIDI is already compact; deflate buys little for the CPU it costs
+        with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as archive:
+            for index, chords in enumerate(progressions):
+                midi_bytes, _ = render_midi(chords, seed)
+                archive.writestr(f'progression_{index:05d}.mid', midi_bytes)
+        return Response(buffer.getvalue(), mimetype='application/zip', headers={
+            'Content-Disposition': 'attachment; filename="progressions.zip"'
+        })
+
+    except Exception as e:
+        print(f"Batch MIDI export error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+def validate_chords(chords):
+    """Error message for a malformed 'chords' field (a list of chord symbols), or None."""
+    if not isinstance(chords, list) or not all(isinstance(chord, str) for chord in chords):
+        return "'chords' must be a list of chord symbols"
+    if len(chords) > MAX_PROGRESSION_CHORDS:
+        return f"at most {MAX_PROGRESSION_CHORDS} chords per progression"
+    return None
+
+def validate_progressions(progressions):
+    """Error message for a malformed batch 'progressions' field, or None."""
+    if not isinstance(progressions, list):
+        return "'progressions' must be a list of chord lists"
+    if len(progressions) > MAX_BATCH_PROGRESSIONS:
+        return f"at most {MAX_BATCH_PROGRESSIONS} progressions per request"
+    for chords in progressions:
+        if not isinstance(chords, list) or not all(isinstance(chord, str) for chord in chords):
+            return "'progressions' must be a list of chord lists"
+        if len(chords) > MAX_PROGRESSION_CHORDS:
+            return f"at most {MAX_PROGRESSION_CHORDS} chords per progression"
+    return None
+
+def render_midi(chords, seed=None):
+    """MIDI bytes for a chord list, from the cache when possible. Returns (bytes, cached)."""
+    cache_key = (tuple(chords), seed)
+    midi_bytes = midi_cache.get(cache_key)
+    if midi_bytes is not None:
+        return midi_bytes, True
+
+    # A seeded export draws from its own generator so it is reproducible
+    rng = np.random.RandomState(seed) if seed is not None else None
+
+    # Convert chords to MIDI using your mel_to_midi function
+    # First create a mock mel-spectrogram from chords
+    with timed('midi'):
+        mock_spectrogram = chords_to_mel_spectrogram(chords, rng=rng)
+        midi_data = mel_to_midi(mock_spectrogram, tempo=120, rng=rng)
+
+        # Serialize in memory; no temp file round-trip
+        midi_bytes = midi_to_bytes(midi_data)
+    midi_cache.put(cache_key, midi_bytes)
+    return midi_bytes, False
+
+def chords_to_mel_spectrogram(chords, rng=None):
     """Convert chord symbols to a mock mel-spectrogram for MIDI export"""
+    rng = np.random if rng is None else rng
     # Create a simple mel-spectrogram representation
     # This is a simplified approach - you might want to improve this
     n_mels = 36  # Number of mel bins
@@ -154,89 +836,53 @@ def chords_to_mel_spectrogram(chords):
         
         # Create energy peaks for chord notes
         # This is a simplified representation
-        chord_energy = np.random.rand(n_mels) * 0.5 + 0.3
+        chord_energy = rng.rand(n_mels) * 0.5 + 0.3
         spectrogram[:, start_time:end_time] = chord_energy[:, np.newaxis]
     
     return spectrogram
 
-def convert_sequence_to_chords(sequence, length):
-    """Convert generated mel-spectrogram sequence to chord symbols"""
-    # This uses your actual model output to generate chord progressions
-    # The sequence is a mel-spectrogram that we need to interpret as chords
-    
-    # Common jazz chords for generation
-    jazz_chords = [
-        'Cmaj7', 'Dm7', 'Em7', 'Fmaj7', 'G7', 'Am7', 'Bm7b5',
-        'C7', 'Dm7', 'Em7', 'F7', 'Gm7', 'Am7', 'Bb7',
-        'Cmaj7', 'Dm7', 'G7', 'Cmaj7', 'Fmaj7', 'Dm7', 'G7', 'Cmaj7'
-    ]
-    
-    # Use the sequence to select chords based on energy patterns
-    selected_chords = []
-    
-    # Sample the sequence at regular intervals
-    step_size = max(1, sequence.shape[1] // length)
-    
-    for i in range(length):
-        time_idx = min(i * step_size, sequence.shape[1] - 1)
-        
-        # Get energy distribution at this time step
-        energy_at_time = sequence[:, time_idx]
-        
-        # Use energy patterns to influence chord selection
-        # Higher energy in lower bins suggests root notes
-        low_energy = np.mean(energy_at_time[:12])  # Lower frequency bins
-        mid_energy = np.mean(energy_at_time[12:24])  # Mid frequency bins
-        high_energy = np.mean(energy_at_time[24:])  # Higher frequency bins
-        
-        # Select chord based on energy distribution
-        if low_energy > mid_energy and low_energy > high_energy:
-            # Strong bass suggests root position chords
-            chord_index = int(low_energy * len(jazz_chords)) % len(jazz_chords)
-        elif mid_energy > high_energy:
-            # Mid-range energy suggests inversions or extensions
-            chord_index = int(mid_energy * len(jazz_chords)) % len(jazz_chords)
-        else:
-            # High energy suggests upper extensions
-            chord_index = int(high_energy * len(jazz_chords)) % len(jazz_chords)
-        
-        selected_chords.append(jazz_chords[chord_index])
-    
-    return selected_chords
+def convert_sequence_to_chords(sequence, length, reference=None):
+    """Decode a generated (T, n_mels) sequence into length chord symbols.
+
+    Every frame is matched against chord templates by its chroma relative
+    to the mean of reference (default: the sequence), and the result is
+    smoothed over time (see chord_decoder.py). Each of the length equal
+    slots of the sequence gets the chord held for most of it.
+    """
+    return chord_decoder.decode(sequence, length, reference)
 
 def analyze_jazz_patterns(chords):
-    """Analyze chord progression for common jazz patterns"""
-    patterns = {
-        'ii-V-I': ['Dm7', 'G7', 'Cmaj7'],
-        'I-vi-IV-V': ['Cmaj7', 'Am7', 'Fmaj7', 'G7'],
-        'I-IV-V-I': ['Cmaj7', 'Fmaj7', 'G7', 'Cmaj7'],
-        'vi-ii-V-I': ['Am7', 'Dm7', 'G7', 'Cmaj7'],
-        'iii-vi-ii-V': ['Em7', 'Am7', 'Dm7', 'G7'],
-        'I-vi-ii-V': ['Cmaj7', 'Am7', 'Dm7', 'G7']
-    }
-    
-    found_patterns = []
-    
-    for pattern_name, pattern_chords in patterns.items():
-        if len(chords) >= len(pattern_chords):
-            for i in range(len(chords) - len(pattern_chords) + 1):
-                segment = chords[i:i + len(pattern_chords)]
-                if segment == pattern_chords:
-                    found_patterns.append({
-                        'name': pattern_name,
-                        'start': i,
-                        'length': len(pattern_chords),
-                        'chords': segment
-                    })
-    
-    return found_patterns
+    """Analyze chord progression for common jazz patterns, in any key"""
+    return pattern_library.find(chords)
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Jazz chord progression generator API')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('GENERATOR_WORKERS', 1)),
+                        help='inference worker processes (1 = run rollouts in this process)')
+    parser.add_argument('--max-pending', type=int, default=int(os.environ.get('GENERATOR_MAX_PENDING', 32)),
+                        help='generate requests admitted at once before answering 503')
+    parser.add_argument('--batch-window-ms', type=float, default=5.0,
+                        help='how long to wait for other requests to micro-batch with')
+    parser.add_argument('--precision', choices=PRECISIONS, default=os.environ.get('GENERATOR_PRECISION', 'float32'),
+                        help='inference precision; int8/bfloat16 fall back to float32 if the parity check fails')
+    parser.add_argument('--debug', action='store_true', help='Flask dev server with the reloader')
+    args = parser.parse_args()
+
     # Load model on startup
-    if load_model():
+    if load_model(args.precision):
         print("Starting Flask server...")
-        print("API will be available at: http://localhost:5001")
-        app.run(debug=True, host='0.0.0.0', port=5001)
+        print(f"API will be available at: http://localhost:{args.port}")
+        if args.debug:
+            app.run(debug=True, host='0.0.0.0', port=args.port)
+        else:
+            start_inference_server(args.workers, args.max_pending, args.batch_window_ms)
+            if serve is not None:
+                # Enough HTTP threads that requests past max_pending reach the 503 path quickly
+                serve(app, host='0.0.0.0', port=args.port, threads=args.max_pending + 4)
+            else:
+                print("waitress not installed (pip install waitress); using Flask's threaded server")
+                app.run(host='0.0.0.0', port=args.port, threaded=True)
     else:
         print("Failed to load model. Exiting.")
@@ -0,0 +1,192 @@
+"""Offline best-of-N generation of many progressions across a process pool.
+
+Work is split into shards of --shard-size progressions. Each worker process
+loads the model once, generates its shard and writes it straight to disk:
+
+    <output-dir>/shards/shard_00000.npy   (shard_size, total_length, n_mels) float32
+    <output-dir>/midi/progression_00000.mid
+    <output-dir>/manifest.jsonl           one line per finished shard
+
+Progression i always uses seed --seed + i, so output is reproducible and an
+interrupted run can be resumed: re-running the same command skips every
+shard already recorded in the manifest. --count may be raised on resume:
+new shards are appended, and a partial last shard is regenerated at full size.
+
+Usage:
+    python batch_generate.py --count 1000 --attempts 32 --seed 0 --output-dir generated/batch --workers 8
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+
+import numpy as np
+
+sys.path.append(os.path.dirname(__file__))
+from generate import (
+    CHECKPOINT_PATH, SCRIPTED_CHECKPOINT_PATH, SEED_LENGTH, TOTAL_LENGTH,
+    best_of_n, configure_torch_threads, ensure_dir, load_rollout_model, mel_to_midi, midi_to_bytes,
+    temperature_for_attempt, mido
+)
+
+MANIFEST_NAME = 'manifest.jsonl'
+
+# Per-process model used by pool workers
+_worker_model = None
+
+
+def _init_worker(checkpoint_path, scripted_path, num_threads, precision):
+    global _worker_model
+    configure_torch_threads(num_threads)
+    _worker_model = load_rollout_model(checkpoint_path, scripted_path, precision)
+
+
+def _write_atomic(path, data):
+    """Write bytes via a temp file and rename, so readers never see a partial file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def generate_shard(shard_id, indices, base_seed, n_attempts, total_length, output_dir, write_midi):
+    """Generate and write one shard; returns its manifest record."""
+    start = time.perf_counter()
+    temperatures = [temperature_for_attempt(attempt) for attempt in range(n_attempts)]
+    sequences, scores = [], []
+    for index in indices:
+        best_sequence, best_score, _ = best_of_n(
+            _worker_model, temperatures, seed_length=SEED_LENGTH, total_length=total_length, seed=base_seed + index
+        )
+        sequences.append(best_sequence)
+        scores.append(float(best_score))
+        if write_midi:
+            midi_file = mel_to_midi(best_sequence.T, rng=np.random.RandomState(base_seed + index))
+            _write_atomic(os.path.join(output_dir, 'midi', f'progression_{index:05d}.mid'), midi_to_bytes(midi_file))
+
+    shard_path = os.path.join(output_dir, 'shards', f'shard_{shard_id:05d}.npy')
+    buffer = io.BytesIO()
+    np.save(buffer, np.stack(sequences))
+    _write_atomic(shard_path, buffer.getvalue())
+
+    return {
+        'shard': shard_id,
+        'path': os.path.relpath(shard_path, output_dir),
+        'indices': list(indices),
+        'seeds': [base_seed + index for index in indices],
+        'scores': scores,
+        'attempts': n_attempts,
+        'total_length': total_length,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def read_manifest(path):
+    """Shard ids already finished, ignoring a torn last line from an interrupted write."""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            done[record['shard']] = record
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, required=True, help='number of progressions to generate')
+    parser.add_argument('--attempts', type=int, default=16, help='best-of-N candidates per progression')
+    parser.add_argument('--seed', type=int, default=0, help='base seed; progression i uses seed + i')
+    parser.add_argument('--output-dir', default=os.path.join('generated', 'batch'))
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--shard-size', type=int, default=16, help='progressions per .npy shard')
+    parser.add_argument('--total-length', type=int, default=TOTAL_LENGTH, help='frames per progression, seed included')
+    parser.add_argument('--no-midi', action='store_true', help='skip writing .mid files')
+    parser.add_argument('--checkpoint', default=CHECKPOINT_PATH)
+    parser.add_argument('--scripted', default=SCRIPTED_CHECKPOINT_PATH)
+    parser.add_argument('--precision', choices=['float32', 'int8', 'bfloat16'], default='float32',
+                        help='inference precision (check it first with quantize.py)')
+    args = parser.parse_args()
+
+    write_midi = not args.no_midi
+    if write_midi and mido is None:
+        print("mido not installed; writing .npy shards only (pip install mido)")
+        write_midi = False
+
+    ensure_dir(os.path.join(args.output_dir, 'shards'))
+    if write_midi:
+        ensure_dir(os.path.join(args.output_dir, 'midi'))
+
+    manifest_path = os.path.join(args.output_dir, MANIFEST_NAME)
+    done = read_manifest(manifest_path)
+    shards = [
+        (shard_id, list(range(start, min(start + args.shard_size, args.count))))
+        for shard_id, start in enumerate(range(0, args.count, args.shard_size))
+    ]
+    for shard_id, indices in shards:
+        record = done.get(shard_id)
+        if record is None:
+            continue
+        if record['indices'] != indices and record['indices'] == indices[:len(record['indices'])]:
+            # --count grew: the old last shard was partial. Its progressions come out the same when
+            # it is regenerated at full size, and the new manifest line supersedes the old one.
+            del done[shard_id]
+            continue
+        if (record['indices'] != indices or record['seeds'][0] != args.seed + indices[0]
+                or record['attempts'] != args.attempts or record['total_length'] != args.total_length):
+            raise SystemExit(f"{manifest_path} was written with different --count/--shard-size/--seed/--attempts/"
+                             f"--total-length; use a new --output-dir or the original arguments "
+                             f"(a larger --count is fine)")
+    pending = [(shard_id, indices) for shard_id, indices in shards if shard_id not in done]
+
+    print(f"{len(shards)} shards ({args.count} progressions), {len(shards) - len(pending)} already done, "
+          f"{len(pending)} to generate with {args.workers} workers")
+    if not pending:
+        return
+
+    # Terminate a torn last line so new records don't get appended onto it
+    if os.path.exists(manifest_path) and os.path.getsize(manifest_path):
+        with open(manifest_path, 'rb+') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+
+    threads_per_worker = max(1, (os.cpu_count() or 1) // args.workers)
+    start = time.perf_counter()
+    finished = 0
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker,
+        initargs=(args.checkpoint, args.scripted, threads_per_worker, args.precision),
+    ) as pool, open(manifest_path, 'a') as manifest:
+        futures = [
+            pool.submit(generate_shard, shard_id, indices, args.seed, args.attempts,
+                        args.total_length, args.output_dir, write_midi)
+            for shard_id, indices in pending
+        ]
+        for future in as_completed(futures):
+            record = future.result()
+            # A shard only counts as done once its manifest line is on disk
+            manifest.write(json.dumps(record) + '\n')
+            manifest.flush()
+            os.fsync(manifest.fileno())
+
+            finished += len(record['indices'])
+            elapsed = time.perf_counter() - start
+            print(f"Shard {record['shard']:5d}: best score {max(record['scores']):.3f} "
+                  f"({finished} progressions, {finished / elapsed:.1f}/s)")
+
+    print(f"Done in {time.perf_counter() - start:.1f}s -> {args.output_dir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,336 @@
+"""Benchmark suite for the generation stack, runnable without the real checkpoint.
+
+Uses a synthetic stand-in model with the checkpoint's interface
+(nn.ModuleList([nn.RNN(64, hidden), nn.Linear(hidden, 64)])) and fixed
+seeds, then measures:
+
+    generate_single              per sequence length
+    generate_batch               per candidate batch size and torch thread count
+    best_of_n                    per attempt count
+    successive_halving           per attempt count
+    precision                    generate_batch with float32 / int8 / bfloat16 weights
+    evaluate_sequence_quality    single sequence and stacked batches
+    mel_to_midi                  per sequence length
+    convert_sequence_to_chords   per progression length, and for long rollouts
+    endpoints                    /api/generate, /api/analyze, /api/export/midi via the Flask test client
+    http_load                    concurrent /api/generate requests against a local server
+
+Results are written as JSON. With --baseline, each benchmark is compared to
+the same benchmark in an earlier results file, and the exit status is 1 if
+any got slower by more than --tolerance.
+
+Usage:
+    python benchmark.py --output bench.json
+    python benchmark.py --quick --baseline bench.json --output bench_new.json
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(HERE)
+from generate import (
+    SEED_LENGTH, TOTAL_LENGTH, Deadline, best_of_n, evaluate_sequence_quality, generate_batch, generate_single,
+    mel_to_midi, successive_halving, temperature_for_attempt, mido
+)
+from quantize import PRECISIONS, quantize_model
+
+N_MELS = 64  # Feature size of the checkpoint and the seed data
+
+
+def synthetic_model(hidden_size=64, seed=0):
+    """A randomly initialized model with the checkpoint's structure."""
+    torch.manual_seed(seed)
+    model = nn.ModuleList([nn.RNN(N_MELS, hidden_size, batch_first=True), nn.Linear(hidden_size, N_MELS)])
+    return model.eval()
+
+
+def measure(fn, repeats, warmup=1):
+    """Latency statistics of fn() over repeats calls, after warmup untimed calls."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        'repeats': repeats,
+        'mean_ms': statistics.fmean(samples) * 1000,
+        'p50_ms': statistics.median(samples) * 1000,
+        'p90_ms': samples[int(0.9 * (len(samples) - 1))] * 1000,
+        'min_ms': samples[0] * 1000,
+    }
+
+
+class Suite:
+    def __init__(self, repeats):
+        self.repeats = repeats
+        self.results = []
+
+    def run(self, name, params, fn, items=1, repeats=None):
+        """Time fn and record it; items is the work per call, for throughput."""
+        stats = measure(fn, repeats or self.repeats)
+        stats['throughput_per_s'] = items / (stats['mean_ms'] / 1000)
+        record = {'name': name, 'params': params, **stats}
+        self.results.append(record)
+        print(f"{result_key(record):<60} p50 {stats['p50_ms']:9.2f}ms  "
+              f"{stats['throughput_per_s']:10.1f}/s")
+        return record
+
+
+def quiet(fn):
+    """fn with the API's per-request progress prints discarded."""
+    def call():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return fn()
+    return call
+
+
+def result_key(record):
+    params = ','.join(f'{k}={v}' for k, v in sorted(record['params'].items()))
+    return f"{record['name']}[{params}]"
+
+
+def bench_generation(suite, model, grid):
+    for total_length in grid['lengths']:
+        torch.manual_seed(0)
+        suite.run('generate_single', {'total_length': total_length},
+                  lambda: generate_single(model, 1.0, seed_length=SEED_LENGTH, total_length=total_length),
+                  items=total_length - SEED_LENGTH)
+
+    default_threads = torch.get_num_threads()
+    for threads in grid['threads']:
+        torch.set_num_threads(threads)
+        for batch_size in grid['batch_sizes']:
+            temperatures = [1.0] * batch_size
+            suite.run('generate_batch', {'batch_size': batch_size, 'threads': threads},
+                      lambda: generate_batch(model, temperatures, seed_length=SEED_LENGTH,
+                                             total_length=TOTAL_LENGTH, seed=0),
+                      items=batch_size)
+    torch.set_num_threads(default_threads)
+
+    # A deadline that never expires: the cost of checking it before every rollout step
+    temperatures = [1.0] * grid['batch_sizes'][-1]
+    suite.run('generate_batch_deadline', {'batch_size': len(temperatures)},
+              lambda: generate_batch(model, temperatures, seed_length=SEED_LENGTH, total_length=TOTAL_LENGTH, seed=0,
+                                     deadline=Deadline(3600)),
+              items=len(temperatures))
+
+    for precision in PRECISIONS:
+        quantized = quantize_model(model, precision)
+        temperatures = [1.0] * grid['batch_sizes'][-1]
+        suite.run('precision', {'precision': precision, 'batch_size': len(temperatures)},
+                  lambda: generate_batch(quantized, temperatures, seed_length=SEED_LENGTH,
+                                         total_length=TOTAL_LENGTH, seed=0),
+                  items=len(temperatures))
+
+    for attempts in grid['attempts']:
+        temperatures = [temperature_for_attempt(attempt) for attempt in range(attempts)]
+        suite.run('best_of_n', {'attempts': attempts},
+                  lambda: best_of_n(model, temperatures, seed_length=SEED_LENGTH, total_length=TOTAL_LENGTH, seed=0))
+        suite.run('successive_halving', {'attempts': attempts},
+                  lambda: successive_halving(model, temperatures, seed_length=SEED_LENGTH, total_length=TOTAL_LENGTH,
+                                             seed=0))
+
+
+def bench_postprocessing(suite, grid):
+    rng = np.random.RandomState(0)
+    sequence = rng.randn(TOTAL_LENGTH, N_MELS).astype(np.float32)
+    suite.run('evaluate_sequence_quality', {'input': 'single'}, lambda: evaluate_sequence_quality(sequence))
+    for batch_size in grid['batch_sizes']:
+        batch = rng.randn(batch_size, TOTAL_LENGTH, N_MELS).astype(np.float32)
+        suite.run('evaluate_sequence_quality', {'input': 'batch', 'batch_size': batch_size},
+                  lambda: evaluate_sequence_quality(batch), items=batch_size)
+
+    if mido is not None:
+        for total_length in grid['lengths']:
+            mel = np.abs(rng.randn(N_MELS, total_length))
+            suite.run('mel_to_midi', {'total_length': total_length},
+                      lambda: mel_to_midi(mel, rng=np.random.RandomState(0)))
+    else:
+        print("mido not installed; skipping mel_to_midi")
+
+    from api import convert_sequence_to_chords
+    for n_chords in grid['chords']:
+        suite.run('convert_sequence_to_chords', {'chords': n_chords},
+                  lambda: convert_sequence_to_chords(sequence, n_chords), items=n_chords)
+    # Long rollouts, at the streaming endpoint's 12 frames per chord
+    for n_frames in grid['decode_frames']:
+        long_sequence = rng.randn(n_frames, N_MELS).astype(np.float32)
+        suite.run('convert_sequence_to_chords', {'frames': n_frames},
+                  lambda: convert_sequence_to_chords(long_sequence, n_frames // 12), items=n_frames)
+
+
+def use_synthetic_model(api, model):
+    api.activate_version(api.model_registry.register(model, 'synthetic', format='synthetic'))
+
+
+def bench_endpoints(suite, api):
+    client = api.app.test_client()
+    progression = ['Dm7', 'G7', 'Cmaj7', 'Am7', 'Dm7', 'G7', 'Cmaj7', 'Cmaj7']
+    # Unseeded so every call does a full rollout instead of hitting the response cache
+    suite.run('endpoint', {'path': '/api/generate'},
+              quiet(lambda: client.post('/api/generate', json={'temperature': 1.2, 'length': 8})))
+    suite.run('endpoint', {'path': '/api/analyze'},
+              lambda: client.post('/api/analyze', json={'chords': progression}))
+    if mido is not None:
+        api.midi_cache.clear()
+        api.midi_cache.max_entries = 0  # Measure rendering, not cache hits
+        suite.run('endpoint', {'path': '/api/export/midi'},
+                  lambda: client.post('/api/export/midi', json={'chords': progression, 'format': 'binary'}))
+        api.midi_cache.max_entries = 512
+
+
+def bench_http_load(suite, api, concurrency, n_requests):
+    """Concurrent unseeded /api/generate requests against a real local server."""
+    from werkzeug.serving import make_server
+
+    api.start_inference_server(workers=1, max_pending=max(32, concurrency))
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)  # No access log line per request
+    server = make_server('127.0.0.1', 0, api.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f'http://127.0.0.1:{server.server_port}/api/generate'
+    body = json.dumps({'temperature': 1.2, 'length': 8}).encode()
+
+    def one_request(_):
+        request = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        return time.perf_counter() - start, status
+
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool, contextlib.redirect_stdout(io.StringIO()):
+            outcomes = list(pool.map(one_request, range(n_requests)))
+        elapsed = time.perf_counter() - start
+    finally:
+        server.shutdown()
+
+    latencies = sorted(latency for latency, status in outcomes if status == 200)
+    statuses = {}
+    for _, status in outcomes:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    record = {
+        'name': 'http_load',
+        'params': {'concurrency': concurrency, 'requests': n_requests},
+        'repeats': n_requests,
+        'statuses': statuses,
+        'throughput_per_s': len(latencies) / elapsed,
+        'mean_ms': statistics.fmean(latencies) * 1000 if latencies else None,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else None,
+        'p90_ms': latencies[int(0.9 * (len(latencies) - 1))] * 1000 if latencies else None,
+        'p99_ms': latencies[int(0.99 * (len(latencies) - 1))] * 1000 if latencies else None,
+        'min_ms': latencies[0] * 1000 if latencies else None,
+    }
+    suite.results.append(record)
+    print(f"{result_key(record):<60} p50 {record['p50_ms'] or float('nan'):9.2f}ms  "
+          f"{record['throughput_per_s']:10.1f}/s  statuses {statuses}")
+
+
+def compare(results, baseline, tolerance):
+    """Print p50 changes against a baseline; returns the keys that regressed beyond tolerance."""
+    previous = {result_key(record): record for record in baseline['results']}
+    regressions = []
+    print(f"\n{'benchmark':<60} {'baseline':>10} {'now':>10} {'change':>8}")
+    for record in results:
+        key = result_key(record)
+        old = previous.get(key)
+        if old is None or not old.get('p50_ms') or record.get('p50_ms') is None:
+            continue
+        change = record['p50_ms'] / old['p50_ms'] - 1
+        flag = ''
+        if change > tolerance:
+            regressions.append(key)
+            flag = '  REGRESSION'
+        print(f"{key:<60} {old['p50_ms']:9.2f}ms {record['p50_ms']:9.2f}ms {change:+7.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='allowed p50 slowdown before failing (0.15 = 15%%)')
+    parser.add_argument('--quick', action='store_true', help='smaller grid and fewer repeats')
+    parser.add_argument('--repeats', type=int, default=None)
+    parser.add_argument('--hidden-size', type=int, default=64, help='hidden size of the synthetic RNN')
+    parser.add_argument('--concurrency', type=int, default=8, help='parallel clients in the HTTP load test')
+    parser.add_argument('--http-requests', type=int, default=None, help='requests in the HTTP load test')
+    parser.add_argument('--skip-http', action='store_true')
+    args = parser.parse_args()
+
+    cpus = os.cpu_count() or 1
+    if args.quick:
+        grid = {'lengths': [150, 200], 'batch_sizes': [1, 8], 'attempts': [3, 10],
+                'threads': [1], 'chords': [8, 32], 'decode_frames': [1200]}
+        repeats, http_requests = args.repeats or 3, args.http_requests or 16
+    else:
+        grid = {'lengths': [150, 200, 400], 'batch_sizes': [1, 4, 16, 64], 'attempts': [3, 10, 30],
+                'threads': sorted({1, max(1, cpus // 2), cpus}), 'chords': [8, 32, 128],
+                'decode_frames': [1200, 6144]}
+        repeats, http_requests = args.repeats or 10, args.http_requests or 64
+
+    model = synthetic_model(args.hidden_size)
+    suite = Suite(repeats)
+    bench_generation(suite, model, grid)
+    bench_postprocessing(suite, grid)
+
+    import api
+    use_synthetic_model(api, model)
+    bench_endpoints(suite, api)
+    if not args.skip_http:
+        bench_http_load(suite, api, args.concurrency, http_requests)
+
+    output = {
+        'meta': {
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': cpus,
+            'torch_threads': torch.get_num_threads(),
+            'hidden_size': args.hidden_size,
+            'grid': grid,
+        },
+        'results': suite.results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(suite.results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) slower than baseline by more than {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Compare cold start, first-request and steady-state latency of the API per model format.
+
+Each format runs in a fresh Python process so imports and model loading are
+measured cold.
+
+Usage:
+    python benchmark_startup.py [--requests 20] [--threads N]
+"""
+import time
+_process_start = time.perf_counter()
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_child(fmt, n_requests):
+    """Measure one format inside this process and print the result as JSON."""
+    # Keep the API's progress prints out of the JSON output
+    with contextlib.redirect_stdout(io.StringIO()):
+        sys.path.append(HERE)
+        import api
+        if not api.load_model(scripted=(fmt == 'torchscript')):
+            raise SystemExit(f"Model failed to load for format {fmt}")
+        cold_start = time.perf_counter() - _process_start
+
+        client = api.app.test_client()
+        payload = {'temperature': 1.2, 'length': 8}
+
+        start = time.perf_counter()
+        client.post('/api/generate', json=payload)
+        first_request = time.perf_counter() - start
+
+        latencies = []
+        for _ in range(n_requests):
+            start = time.perf_counter()
+            client.post('/api/generate', json=payload)
+            latencies.append(time.perf_counter() - start)
+
+    print(json.dumps({
+        'format': api.model_info['format'],
+        'torch_threads': api.model_info['torch_threads'],
+        'cold_start_s': cold_start,
+        'load_time_s': api.model_info['load_time_s'],
+        'warmup_time_s': api.model_info['warmup_time_s'],
+        'first_request_ms': first_request * 1000,
+        'steady_p50_ms': statistics.median(latencies) * 1000,
+        'steady_p90_ms': sorted(latencies)[int(0.9 * (len(latencies) - 1))] * 1000,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=20, help='steady-state requests per format')
+    parser.add_argument('--threads', type=int, default=None, help='torch threads (TORCH_NUM_THREADS)')
+    parser.add_argument('--child', choices=['eager', 'torchscript'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.requests)
+        return
+
+    # The API scripts the rollout module itself from the shared weights (registry.py)
+    formats = ['eager', 'torchscript']
+    env = dict(os.environ)
+    if args.threads is not None:
+        env['TORCH_NUM_THREADS'] = str(args.threads)
+
+    results = []
+    for fmt in formats:
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', fmt, '--requests', str(args.requests)],
+            cwd=HERE, env=env, capture_output=True, text=True, check=True,
+        )
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    print(f"{'format':<12} {'threads':>7} {'cold start':>11} {'load':>8} {'warm-up':>8} "
+          f"{'first req':>10} {'p50':>9} {'p90':>9}")
+    for r in results:
+        print(f"{r['format']:<12} {r['torch_threads']:>7} {r['cold_start_s']:>10.2f}s {r['load_time_s']:>7.3f}s "
+              f"{r['warmup_time_s']:>7.3f}s {r['first_request_ms']:>8.1f}ms "
+              f"{r['steady_p50_ms']:>7.1f}ms {r['steady_p90_ms']:>7.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""Chord decoding from generated mel sequences by chroma template matching.
+
+Every frame of a (T, n_mels) sequence is folded into a 12-bin chroma vector
+with one matmul against a precomputed mel-to-chroma matrix, relative to the
+mean chroma of the sequence (or of a longer reference). Windows of
+WINDOW_FRAMES frames are scored against a bank of chord templates
+(qualities x 12 roots) with a second matmul, and a Viterbi pass over the
+windows smooths the best chords (switching chord costs SWITCH_PENALTY,
+moving the root up a fourth costs less). Each chord slot then reports the
+chord held for most of its frames.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+from patterns import NOTE_NAMES
+
+# Mel bins span the same C3-C6 range that generate.pitch_to_bin_table assumes
+MEL_PITCH_RANGE = (48, 84)
+
+# Chord qualities as (symbol suffix, intervals above the root); all of them are
+# in page.jsx's CHORD_TYPES, so the frontend plays what was decoded
+QUALITIES = (
+    ('maj7', (0, 4, 7, 11)),
+    ('7', (0, 4, 7, 10)),
+    ('m7', (0, 3, 7, 10)),
+    ('m7b5', (0, 3, 6, 10)),
+    ('dim', (0, 3, 6)),
+    ('7#5', (0, 4, 8, 10)),
+)
+ROOT_WEIGHT = 1.5       # Template weight of the root relative to the other chord tones
+WINDOW_FRAMES = 4       # Frames pooled per scored window (as in generate.mel_to_midi)
+SWITCH_PENALTY = 0.3    # Score cost of changing chord between windows (scores are correlations, -1..1)
+FOURTH_BONUS = 0.1      # Refund for root motion up a fourth (ii-V, V-I)
+
+
+@lru_cache(maxsize=None)
+def mel_to_chroma_matrix(n_mels):
+    """(n_mels, 12) matrix folding mel energies into pitch classes, built once per n_mels.
+
+    Each mel bin is split between the two pitch classes nearest its pitch,
+    and each pitch class averages the bins that feed it, so a constant
+    offset in the mel energies shifts every chroma bin equally.
+    """
+    pitches = np.linspace(MEL_PITCH_RANGE[0], MEL_PITCH_RANGE[1], n_mels)
+    distance = np.abs((pitches[:, np.newaxis] - np.arange(12)[np.newaxis, :] + 6) % 12 - 6)
+    matrix = np.maximum(0.0, 1.0 - distance)
+    matrix /= np.maximum(matrix.sum(axis=0, keepdims=True), 1e-12)
+    return matrix.astype(np.float32)
+
+
+def _center_and_normalize(vectors):
+    centered = vectors - vectors.mean(axis=-1, keepdims=True)
+    norms = np.linalg.norm(centered, axis=-1, keepdims=True)
+    return centered / np.maximum(norms, 1e-8)
+
+
+class ChordDecoder:
+    """Decodes (T, n_mels) sequences into chord symbols.
+
+    Templates are stored quality-major: state k is quality k // 12 with root
+    k % 12, and symbols[k] is its name.
+    """
+
+    def __init__(self, qualities=QUALITIES, switch_penalty=SWITCH_PENALTY, fourth_bonus=FOURTH_BONUS):
+        self.switch_penalty = switch_penalty
+        self.fourth_bonus = fourth_bonus
+        self.n_qualities = len(qualities)
+        self.symbols = [f"{root}{suffix}" for suffix, _ in qualities for root in NOTE_NAMES]
+
+        templates = np.zeros((self.n_qualities, 12, 12), dtype=np.float32)
+        for q, (_, intervals) in enumerate(qualities):
+            for root in range(12):
+                templates[q, root, [(root + i) % 12 for i in intervals]] = 1.0
+                templates[q, root, root] = ROOT_WEIGHT
+        # (12, n_states), centered and unit-norm so a template's score is its correlation with the chroma
+        self.templates = np.ascontiguousarray(_center_and_normalize(templates.reshape(-1, 12)).T)
+
+        self._roots = np.arange(12)
+
+    def chroma(self, sequence):
+        """(T, 12) chroma of a (T, n_mels) sequence."""
+        sequence = np.asarray(sequence, dtype=np.float32)
+        return sequence @ mel_to_chroma_matrix(sequence.shape[1])
+
+    def window_scores(self, sequence, reference=None):
+        """(n_windows, n_states) correlation of every window's chroma with every template.
+
+        The mean chroma of reference (default: the sequence itself) is
+        removed first, so a spectral tilt shared by every frame doesn't pick
+        the same chord everywhere. Frames are pooled in windows of
+        WINDOW_FRAMES (a shorter last window takes the remainder); returns
+        the scores and each window's frame count.
+        """
+        chroma = self.chroma(sequence)
+        if reference is None:
+            chroma -= chroma.mean(axis=0)
+        else:
+            reference = np.asarray(reference, dtype=np.float32)
+            chroma -= reference.mean(axis=0) @ mel_to_chroma_matrix(reference.shape[1])
+        n_frames = chroma.shape[0]
+        starts = np.arange(0, n_frames, WINDOW_FRAMES)
+        pooled = np.add.reduceat(chroma, starts, axis=0)
+        sizes = np.diff(np.append(starts, n_frames))
+        return _center_and_normalize(pooled) @ self.templates, sizes
+
+    def viterbi(self, scores):
+        """Most likely state path through (T, n_states) scores, as a (T,) array.
+
+        Transitions are structured (stay, switch to anything, or move the
+        root up a fourth), so a step costs O(n_states) rather than
+        O(n_states^2).
+        """
+        n_steps = scores.shape[0]
+        by_root = scores.reshape(n_steps, self.n_qualities, 12)
+        fourth_from = (self._roots - 5) % 12
+        fourth_cost = self.fourth_bonus - self.switch_penalty
+
+        # Only the running maxima are computed in the loop; the decisions are
+        # recovered from the stored deltas afterwards in one vectorized pass
+        deltas = np.empty_like(by_root)
+        moved = np.empty((n_steps, 12), dtype=scores.dtype)
+        deltas[0] = by_root[0]
+        column_max = np.maximum.reduce
+        for t in range(1, n_steps):
+            root_max = column_max(deltas[t - 1], axis=0)
+            np.maximum(root_max[fourth_from] + fourth_cost, column_max(root_max) - self.switch_penalty,
+                       out=moved[t])
+            np.maximum(deltas[t - 1], moved[t], out=deltas[t])
+            deltas[t] += by_root[t]
+
+        # Decisions for step t (into frame t) are at index t - 1
+        previous = deltas[:-1]
+        flat = previous.reshape(n_steps - 1, self.n_qualities * 12)
+        best = flat.argmax(axis=1)
+        root_quality = previous.argmax(axis=1)
+        fourth_wins = previous.max(axis=1)[:, fourth_from] + fourth_cost > flat.max(axis=1, keepdims=True) \
+            - self.switch_penalty
+        stays = previous >= moved[1:, np.newaxis, :]
+
+        path = np.empty(n_steps, dtype=np.intp)
+        state = int(deltas[-1].argmax())
+        path[-1] = state
+        for t in range(n_steps - 2, -1, -1):
+            quality, root = divmod(state, 12)
+            if not stays[t, quality, root]:
+                if fourth_wins[t, root]:
+                    previous_root = fourth_from[root]
+                    state = root_quality[t, previous_root] * 12 + previous_root
+                else:
+                    state = best[t]
+            path[t] = state
+        return path
+
+    def decode_states(self, sequence, n_chords, reference=None):
+        """State index of each of n_chords equal slots of the sequence."""
+        sequence = np.asarray(sequence)
+        n_frames = sequence.shape[0]
+        if n_frames == 0:
+            raise ValueError("cannot decode chords from an empty sequence")
+        scores, sizes = self.window_scores(sequence, reference)
+        path = np.repeat(self.viterbi(scores), sizes)  # back to one state per frame
+        if n_frames < n_chords:
+            # Fewer frames than slots: each slot takes the frame it falls in
+            return path[np.arange(n_chords) * n_frames // n_chords]
+
+        # Majority vote of the smoothed path within each slot
+        n_states = len(self.symbols)
+        slot = np.arange(n_frames) * n_chords // n_frames
+        counts = np.bincount(slot * n_states + path, minlength=n_chords * n_states)
+        return np.argmax(counts.reshape(n_chords, n_states), axis=1)
+
+    def decode(self, sequence, n_chords, reference=None):
+        """n_chords chord symbols for a (T, n_mels) sequence (see window_scores for reference)."""
+        return [self.symbols[k] for k in self.decode_states(sequence, n_chords, reference)]
@@ -0,0 +1,250 @@
+"""Packed feature corpus: every track of metadata.csv in one memory-mappable file.
+
+Opening thousands of small .npy files is slow on network storage, so
+`pack` concatenates them into a single file that is mapped once:
+
+    header   128 bytes, little-endian (see HEADER)
+    data     (total_frames, n_mels) float16 or float32, time-major, 64-byte aligned
+    index    one (frame_offset u64, n_frames u64, crc32 u32, pad u32) record per track
+    names    UTF-8 JSON list of the source feature paths
+
+Frames are stored time-major, so any window of a track is one contiguous
+slice of the map. Each track has a CRC32 of its bytes (checked by verify),
+and the index and names share one CRC32 (checked on open).
+
+Usage:
+    python corpus.py pack [--metadata data/metadata.csv] [--output data/corpus.bin] [--dtype float16]
+    python corpus.py info data/corpus.bin
+    python corpus.py verify data/corpus.bin
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import struct
+import zlib
+
+import numpy as np
+
+MAGIC = b'MTSFCORP'
+VERSION = 1
+# magic, version, dtype code, n_mels, n_tracks, total_frames, data_offset, index_offset, names_offset,
+# names_length, crc32 of index + names
+HEADER = struct.Struct('<8sIIIIQQQQQI')
+HEADER_SIZE = 128  # HEADER plus room to grow
+ALIGNMENT = 64
+DTYPES = {1: np.dtype('<f2'), 2: np.dtype('<f4')}
+DTYPE_CODES = {'float16': 1, 'float32': 2}
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('frames', '<u8'), ('crc32', '<u4'), ('pad', '<u4')])
+
+
+class CorpusError(Exception):
+    """Raised for a missing, truncated or corrupted corpus file."""
+
+
+def read_feature_paths(metadata_csv):
+    """Feature file paths listed in a metadata CSV (the 'feature_path' column, else column 2)."""
+    with open(metadata_csv, 'r', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        # Same column as the old split(',')[2] lookup unless the header names it
+        path_col = header.index('feature_path') if 'feature_path' in header else 2
+        return [row[path_col].strip() for row in reader if len(row) > path_col]
+
+
+def _align(f):
+    padding = -f.tell() % ALIGNMENT
+    f.write(b'\0' * padding)
+    return f.tell()
+
+
+def pack(metadata_csv, output_path, dtype='float16'):
+    """Pack the tracks listed in metadata_csv into output_path.
+
+    Tracks that can't be read, or whose mel count differs from the first
+    track's, are skipped. Returns (tracks packed, [(path, reason), ...] skipped).
+    """
+    storage = DTYPES[DTYPE_CODES[dtype]]
+    names, index, skipped = [], [], []
+    n_mels = None
+    total_frames = 0
+
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(b'\0' * HEADER_SIZE)
+        data_offset = _align(f)
+        for path in read_feature_paths(metadata_csv):
+            try:
+                features = np.load(path, mmap_mode='r')
+            except (OSError, ValueError) as e:
+                skipped.append((path, str(e)))
+                continue
+            if features.ndim != 2:
+                skipped.append((path, f"expected (n_mels, frames), got shape {features.shape}"))
+                continue
+            if n_mels is None:
+                n_mels = features.shape[0]
+            if features.shape[0] != n_mels:
+                skipped.append((path, f"{features.shape[0]} mel bins, corpus has {n_mels}"))
+                continue
+
+            # Stored time-major: (frames, n_mels)
+            block = np.ascontiguousarray(features.T, dtype=storage).tobytes()
+            f.write(block)
+            index.append((total_frames, features.shape[1], zlib.crc32(block), 0))
+            names.append(path)
+            total_frames += features.shape[1]
+
+        index_offset = _align(f)
+        index_bytes = np.array(index, dtype=INDEX_DTYPE).tobytes()
+        f.write(index_bytes)
+        names_offset = f.tell()
+        names_bytes = json.dumps(names).encode('utf-8')
+        f.write(names_bytes)
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, DTYPE_CODES[dtype], n_mels or 0, len(index), total_frames,
+                            data_offset, index_offset, names_offset, len(names_bytes),
+                            zlib.crc32(names_bytes, zlib.crc32(index_bytes))))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, output_path)
+    return len(index), skipped
+
+
+class Corpus:
+    """Read-only view of a packed corpus file.
+
+    Track and window reads return views into the memory map (no copy); pages
+    are read from disk on first access.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path, 'rb') as f:
+                header = f.read(HEADER_SIZE)
+                if len(header) < HEADER.size:
+                    raise CorpusError(f"{path} is truncated")
+                (magic, version, dtype_code, self.n_mels, n_tracks, self.total_frames, data_offset,
+                 index_offset, names_offset, names_length, index_crc) = HEADER.unpack_from(header)
+                if magic != MAGIC:
+                    raise CorpusError(f"{path} is not a packed corpus")
+                if version != VERSION:
+                    raise CorpusError(f"{path} has format version {version}, expected {VERSION}")
+                if dtype_code not in DTYPES:
+                    raise CorpusError(f"{path} has unknown dtype code {dtype_code}")
+                f.seek(index_offset)
+                index_bytes = f.read(n_tracks * INDEX_DTYPE.itemsize)
+                names_bytes = f.read(names_length)
+        except OSError as e:
+            raise CorpusError(f"could not read {path}: {e}") from e
+
+        if len(index_bytes) != n_tracks * INDEX_DTYPE.itemsize or len(names_bytes) != names_length:
+            raise CorpusError(f"{path} is truncated")
+        if zlib.crc32(names_bytes, zlib.crc32(index_bytes)) != index_crc:
+            raise CorpusError(f"{path} has a corrupted index (checksum mismatch)")
+
+        self.dtype = DTYPES[dtype_code]
+        self.index = np.frombuffer(index_bytes, dtype=INDEX_DTYPE)
+        self.names = json.loads(names_bytes.decode('utf-8'))
+        expected_size = data_offset + self.total_frames * self.n_mels * self.dtype.itemsize
+        if os.path.getsize(path) < expected_size:
+            raise CorpusError(f"{path} is truncated")
+        if self.total_frames:
+            # A plain ndarray over the map: slicing an np.memmap subclass costs more than the read
+            self.data = np.memmap(path, dtype=self.dtype, mode='r', offset=data_offset,
+                                  shape=(self.total_frames, self.n_mels)).view(np.ndarray)
+        else:
+            self.data = np.empty((0, self.n_mels), dtype=self.dtype)
+
+    def __len__(self):
+        return len(self.index)
+
+    def track(self, i):
+        """Frames of track i as a (n_frames, n_mels) view."""
+        offset, n_frames = int(self.index[i]['offset']), int(self.index[i]['frames'])
+        return self.data[offset:offset + n_frames]
+
+    def window(self, i, start, length):
+        """length frames of track i from start, as a (length, n_mels) view."""
+        n_frames = int(self.index[i]['frames'])
+        if start < 0 or start + length > n_frames:
+            raise IndexError(f"window [{start}, {start + length}) outside track {i} ({n_frames} frames)")
+        offset = int(self.index[i]['offset']) + start
+        return self.data[offset:offset + length]
+
+    def random_window(self, length, rng=None):
+        """A random (length, n_mels) window: a uniformly chosen track, then a uniform start.
+
+        Tracks shorter than length come back zero-padded (a copy); anything
+        else is a view into the map.
+        """
+        rng = rng or random
+        i = rng.choice(range(len(self.index)))
+        n_frames = int(self.index[i]['frames'])
+        if n_frames > length:
+            return self.window(i, rng.randint(0, n_frames - length), length)
+        window = np.zeros((length, self.n_mels), dtype=self.dtype)
+        window[:n_frames] = self.track(i)
+        return window
+
+    def __iter__(self):
+        """Lazily yield (name, frames view) per track."""
+        for i, name in enumerate(self.names):
+            yield name, self.track(i)
+
+    def iter_windows(self, length, hop=None):
+        """Lazily yield (track, start, view) for every full window of every track."""
+        hop = hop or length
+        for i in range(len(self.index)):
+            n_frames = int(self.index[i]['frames'])
+            for start in range(0, n_frames - length + 1, hop):
+                yield i, start, self.window(i, start, length)
+
+    def verify(self):
+        """Check every track against its CRC32; returns the names of corrupted tracks."""
+        return [name for i, name in enumerate(self.names)
+                if zlib.crc32(self.track(i).tobytes()) != int(self.index[i]['crc32'])]
+
+    def describe(self):
+        return {
+            'path': self.path,
+            'tracks': len(self.index),
+            'frames': int(self.total_frames),
+            'n_mels': int(self.n_mels),
+            'dtype': self.dtype.name,
+            'size_bytes': os.path.getsize(self.path),
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    pack_parser = commands.add_parser('pack', help='pack metadata.csv + .npy files into one corpus file')
+    pack_parser.add_argument('--metadata', default=os.path.join('data', 'metadata.csv'))
+    pack_parser.add_argument('--output', default=os.path.join('data', 'corpus.bin'))
+    pack_parser.add_argument('--dtype', choices=sorted(DTYPE_CODES), default='float16')
+    for name in ('info', 'verify'):
+        commands.add_parser(name).add_argument('path', nargs='?', default=os.path.join('data', 'corpus.bin'))
+    args = parser.parse_args()
+
+    if args.command == 'pack':
+        n_tracks, skipped = pack(args.metadata, args.output, args.dtype)
+        for path, reason in skipped:
+            print(f"Skipped {path}: {reason}")
+        info = Corpus(args.output).describe()
+        print(f"Packed {n_tracks} tracks ({info['frames']} frames, {info['dtype']}) -> {args.output} "
+              f"({info['size_bytes'] / 1e6:.1f} MB)")
+    elif args.command == 'info':
+        print(json.dumps(Corpus(args.path).describe(), indent=2))
+    else:
+        corpus = Corpus(args.path)
+        bad = corpus.verify()
+        if bad:
+            print(f"{len(bad)} of {len(corpus)} tracks failed their checksum:")
+            for name in bad:
+                print(f"  {name}")
+            raise SystemExit(1)
+        print(f"All {len(corpus)} tracks match their checksums")
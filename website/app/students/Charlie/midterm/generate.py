@@ -1,16 +1,26 @@
 import torch
 import numpy as np
+import io
 import os
 import random
+import threading
+import time
+from functools import lru_cache
+from typing import Optional
 try:
     from mido import MidiFile, MidiTrack, Message, MetaMessage
     import mido
 except ImportError:
     mido = None
 
+from seed_pool import get_seed_pool
+from metrics import RolloutTimer, timed
+
 # Config
 CHECKPOINT_PATH = 'checkpoints/mtsf_model_full.pt'
+SCRIPTED_CHECKPOINT_PATH = 'checkpoints/mtsf_model_scripted.pt'  # Written by export_model.py
 METADATA_CSV = 'data/metadata.csv'
+CORPUS_PATH = 'data/corpus.bin'  # Packed form of METADATA_CSV's features (python corpus.py pack)
 OUTPUT_DIR = 'generated'
 SEED_LENGTH = 100
 TOTAL_LENGTH = 200
@@ -21,8 +31,180 @@ def ensure_dir(path: str) -> None:
     if not os.path.isdir(path):
         os.makedirs(path, exist_ok=True)
 
-def mel_to_midi(mel_spectrogram, tempo=120):
-    """Convert mel-spectrogram to dynamic chord progression MIDI with improved musical logic."""
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's deadline passes before any frame was generated for it."""
+
+
+class Deadline:
+    """Time budget and cancellation token for one request, checked between rollout steps.
+
+    budget_s=None means no time limit (cancel() still stops the rollout).
+    Expiry uses time.monotonic(), which is system-wide, so a Deadline pickled
+    into a worker process keeps its expiry time; cancel() only reaches
+    rollouts running in this process.
+    """
+
+    def __init__(self, budget_s=None):
+        self.budget_s = budget_s
+        self.expires_at = time.monotonic() + budget_s if budget_s is not None else None
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def expired(self):
+        return self._cancelled.is_set() or (self.expires_at is not None and time.monotonic() >= self.expires_at)
+
+    def remaining_s(self):
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def __getstate__(self):
+        # threading.Event doesn't pickle; a worker gets the expiry time and a snapshot of cancelled
+        return {'budget_s': self.budget_s, 'expires_at': self.expires_at, 'cancelled': self.cancelled}
+
+    def __setstate__(self, state):
+        self.budget_s = state['budget_s']
+        self.expires_at = state['expires_at']
+        self._cancelled = threading.Event()
+        if state['cancelled']:
+            self._cancelled.set()
+
+
+class RolloutModule(torch.nn.Module):
+    """Backbone + head fused into one step, in a form TorchScript can export."""
+
+    def __init__(self, backbone, head):
+        super().__init__()
+        self.backbone = backbone
+        self.head = head
+
+    def forward(self, x, hidden: Optional[torch.Tensor] = None):
+        output, hidden = self.backbone(x, hidden)
+        return self.head(output), hidden
+
+
+def rollout_step(model):
+    """Return step(x, hidden) -> (next_frame, hidden) for a checkpoint or an exported module.
+
+    The training checkpoint is a ModuleList of [backbone, head]; the TorchScript
+    export from export_model.py is already a fused RolloutModule.
+    """
+    if isinstance(model, torch.nn.ModuleList):
+        backbone, head = model[0], model[1]
+
+        def step(x, hidden=None):
+            output, hidden = backbone(x, hidden)
+            return head(output), hidden
+        return step
+    return model
+
+
+_loaded_models = {}
+
+
+def load_rollout_model(checkpoint_path=CHECKPOINT_PATH, scripted_path=SCRIPTED_CHECKPOINT_PATH, precision='float32'):
+    """Load the model once per process, preferring the TorchScript export when it is current.
+
+    precision 'int8' or 'bfloat16' converts the eager checkpoint instead (see quantize.py).
+    """
+    key = (os.path.abspath(checkpoint_path), scripted_path and os.path.abspath(scripted_path), precision)
+    if key in _loaded_models:
+        return _loaded_models[key]
+
+    model = None
+    if precision != 'float32':
+        # Imported here: quantize.py builds on this module
+        from quantize import quantize_model
+        checkpoint = torch.load(checkpoint_path, map_location='cpu', weights_only=False)
+        model = quantize_model(checkpoint.eval(), precision)
+    elif scripted_path and os.path.exists(scripted_path):
+        if os.path.exists(checkpoint_path) and os.path.getmtime(scripted_path) < os.path.getmtime(checkpoint_path):
+            print(f"WARNING: {scripted_path} is older than {checkpoint_path}; "
+                  f"re-run export_model.py. Using the eager checkpoint.")
+        else:
+            model = torch.jit.load(scripted_path, map_location='cpu')
+    if model is None:
+        model = torch.load(checkpoint_path, map_location='cpu', weights_only=False)
+
+    model.eval()
+    _loaded_models[key] = model
+    return model
+
+
+def configure_torch_threads(num_threads=None):
+    """Set torch's intra-op thread count (TORCH_NUM_THREADS env var, else up to 4 cores).
+
+    The per-step GEMMs are tiny, so more threads mostly add synchronization.
+    """
+    if num_threads is None:
+        num_threads = int(os.environ.get('TORCH_NUM_THREADS', min(4, os.cpu_count() or 1)))
+    torch.set_num_threads(max(1, num_threads))
+    return torch.get_num_threads()
+
+
+def warm_up(model, n_candidates=3, n_steps=16):
+    """Run a short rollout so lazy initialization and JIT optimization happen before serving."""
+    start = time.perf_counter()
+    # The TorchScript profiling executor specializes after a couple of calls
+    for _ in range(2):
+        generate_batch(model, [1.0] * n_candidates, seed_length=SEED_LENGTH, total_length=SEED_LENGTH + n_steps)
+    return time.perf_counter() - start
+
+# Chord progression patterns for better musical flow
+PROGRESSION_PATTERNS = np.array([
+    [0, 5, 3, 4],    # I-vi-IV-V (common pop progression)
+    [0, 2, 5, 0],    # I-iii-vi-I
+    [0, 4, 2, 5],    # I-V-iii-vi
+    [0, 3, 4, 0],    # I-IV-V-I
+    [0, 5, 2, 4],    # I-vi-iii-V
+])
+DEGREE_OFFSETS = np.array([0, 2, 4, 5, 7, 9, 11])  # I, ii, iii, IV, V, vi, vii
+
+# Chord qualities scored against each window: major, minor, sus2, sus4
+CHORD_INTERVALS = np.array([
+    [0, 4, 7],
+    [0, 3, 7],
+    [0, 2, 7],
+    [0, 5, 7],
+])
+
+
+@lru_cache(maxsize=None)
+def pitch_to_bin_table(n_mels):
+    """Lookup table from MIDI pitch (0-127) to the nearest mel bin, built once per n_mels."""
+    midi_notes = np.linspace(48, 84, n_mels).astype(int)  # C3–C6
+    table = np.argmin(np.abs(midi_notes[np.newaxis, :] - np.arange(128)[:, np.newaxis]), axis=1)
+    return midi_notes, table
+
+
+def window_energies(mel_spectrogram, window_steps):
+    """Mean energy per mel bin for every window, as a (n_windows, n_mels) array."""
+    n_mels, n_timesteps = mel_spectrogram.shape
+    n_full = n_timesteps // window_steps
+    full = mel_spectrogram[:, :n_full * window_steps].reshape(n_mels, n_full, window_steps).mean(axis=2)
+    if n_full * window_steps < n_timesteps:
+        # Shorter last window
+        tail = mel_spectrogram[:, n_full * window_steps:].mean(axis=1)
+        full = np.concatenate([full, tail[:, np.newaxis]], axis=1)
+    return np.ascontiguousarray(full.T)
+
+
+def mel_to_midi(mel_spectrogram, tempo=120, rng=None):
+    """Convert mel-spectrogram to dynamic chord progression MIDI with improved musical logic.
+
+    Root, chord and velocity choices are computed for every window at once;
+    only the MIDI message emission (and its random draws) runs per window.
+    Pass a np.random.RandomState as rng for reproducible output; the default
+    is NumPy's global generator.
+    """
+    rng = np.random if rng is None else rng
     mid = MidiFile()
     mid.ticks_per_beat = 480
     track = MidiTrack()
@@ -31,206 +213,405 @@ def mel_to_midi(mel_spectrogram, tempo=120):
         track.append(MetaMessage('set_tempo', tempo=mido.bpm2tempo(tempo), time=0))
 
     n_mels, n_timesteps = mel_spectrogram.shape
-    midi_notes = np.linspace(48, 84, n_mels).astype(int)  # C3–C6
+    midi_notes, bin_for_pitch = pitch_to_bin_table(n_mels)
 
     # Much shorter windows for maximum chord changes
     window_steps = 4               # Very short chord hold for rapid changes
     ticks_per_step = 120
     chord_ticks = window_steps * ticks_per_step
 
-    # Chord progression patterns for better musical flow
-    progression_patterns = [
-        [0, 5, 3, 4],    # I-vi-IV-V (common pop progression)
-        [0, 2, 5, 0],    # I-iii-vi-I
-        [0, 4, 2, 5],    # I-V-iii-vi
-        [0, 3, 4, 0],    # I-IV-V-I
-        [0, 5, 2, 4],    # I-vi-iii-V
-    ]
-    
-    pattern_idx = 0
-    chord_in_pattern = 0
-    prev_root = None
-
-    for start in range(0, n_timesteps, window_steps):
-        end = min(n_timesteps, start + window_steps)
-        window = mel_spectrogram[:, start:end]
-        avg_energy = window.mean(axis=1)
-
-        # Enhanced root detection with multiple frequency bands
-        low_band = max(1, int(0.3 * n_mels))
-        mid_band = max(1, int(0.6 * n_mels))
-        
-        # Weight different frequency bands
-        low_energy = avg_energy[:low_band]
-        mid_energy = avg_energy[low_band:mid_band]
-        
-        # Find strongest root candidates
-        low_root_idx = int(np.argmax(low_energy))
-        mid_root_idx = int(np.argmax(mid_energy)) + low_band
-        
-        # Choose root based on energy and musical context
-        if low_energy[low_root_idx] > mid_energy[mid_root_idx - low_band] * 1.2:
-            root_idx = low_root_idx
-        else:
-            root_idx = mid_root_idx
-            
-        root_midi = int(midi_notes[root_idx])
-
-        # Use progression patterns for better musical flow
-        if start % (window_steps * 8) == 0:  # Change pattern every 8 chords
-            pattern_idx = (pattern_idx + 1) % len(progression_patterns)
-            chord_in_pattern = 0
-        
-        # Get chord degree from pattern
-        chord_degree = progression_patterns[pattern_idx][chord_in_pattern % len(progression_patterns[pattern_idx])]
-        chord_in_pattern += 1
-        
-        # Apply chord degree to root (simplified circle of fifths)
-        degree_offsets = [0, 2, 4, 5, 7, 9, 11]  # I, ii, iii, IV, V, vi, vii
-        if chord_degree < len(degree_offsets):
-            root_midi = (root_midi + degree_offsets[chord_degree]) % 12 + 48  # Keep in C3-C6 range
-
-        # Enhanced chord quality detection
-        major_intervals = [0, 4, 7]
-        minor_intervals = [0, 3, 7]
-        sus2_intervals = [0, 2, 7]
-        sus4_intervals = [0, 5, 7]
-
-        def nearest_bin(target_midi):
-            return int(np.argmin(np.abs(midi_notes - target_midi)))
-
-        def chord_score(intervals):
-            bins = [nearest_bin(root_midi + iv) for iv in intervals]
-            return float(avg_energy[bins].sum())
-
-        # Choose chord quality based on energy fit
-        chord_types = [major_intervals, minor_intervals, sus2_intervals, sus4_intervals]
-        chord_scores = [chord_score(intervals) for intervals in chord_types]
-        best_chord_idx = np.argmax(chord_scores)
-        intervals = chord_types[best_chord_idx]
-        
-        chord_core = [root_midi + iv for iv in intervals]
-
-        # Add bass note with octave variation
-        bass_octave = max(1, (root_midi - 48) // 12)  # Dynamic octave
-        bass_note = max(24, root_midi - 12 * bass_octave)  # Lower bass
-        chord_notes = [bass_note] + chord_core
+    avg_energy = window_energies(mel_spectrogram, window_steps)  # (n_windows, n_mels)
+    n_windows = avg_energy.shape[0]
+    windows = np.arange(n_windows)
+
+    # Enhanced root detection with multiple frequency bands
+    low_band = max(1, int(0.3 * n_mels))
+    mid_band = max(1, int(0.6 * n_mels))
+
+    # Find strongest root candidates in each band
+    low_root_idx = np.argmax(avg_energy[:, :low_band], axis=1)
+    mid_root_idx = np.argmax(avg_energy[:, low_band:mid_band], axis=1) + low_band
+
+    # Choose root based on energy and musical context
+    low_peak = avg_energy[windows, low_root_idx]
+    mid_peak = avg_energy[windows, mid_root_idx]
+    root_idx = np.where(low_peak > mid_peak * 1.2, low_root_idx, mid_root_idx)
+    root_midi = midi_notes[root_idx]
+
+    # Use progression patterns for better musical flow: the pattern changes
+    # every 8 chords, starting from the second pattern
+    pattern_idx = (windows // 8 + 1) % len(PROGRESSION_PATTERNS)
+    chord_degree = PROGRESSION_PATTERNS[pattern_idx, (windows % 8) % PROGRESSION_PATTERNS.shape[1]]
+
+    # Apply chord degree to root (simplified circle of fifths)
+    root_midi = (root_midi + DEGREE_OFFSETS[chord_degree]) % 12 + 48  # Keep in C3-C6 range
+
+    # Enhanced chord quality detection: score every window x chord quality at once
+    chord_pitches = root_midi[:, np.newaxis, np.newaxis] + CHORD_INTERVALS[np.newaxis]
+    chord_bins = bin_for_pitch[chord_pitches]                    # (n_windows, 4, 3)
+    chord_scores = avg_energy[windows[:, np.newaxis, np.newaxis], chord_bins].sum(axis=2)
+    best_chord_idx = np.argmax(chord_scores, axis=1)
+    chord_core = root_midi[:, np.newaxis] + CHORD_INTERVALS[best_chord_idx]
+
+    # Add bass note with octave variation
+    bass_octave = np.maximum(1, (root_midi - 48) // 12)  # Dynamic octave
+    bass_note = np.maximum(24, root_midi - 12 * bass_octave)  # Lower bass
+
+    # Dynamic velocities based on energy and position
+    base_vel = 70 + avg_energy.mean(axis=1) * 20
+    spread = 15
+
+    for w in range(n_windows):
+        chord_notes = [int(bass_note[w])] + [int(note) for note in chord_core[w]]
 
         # Add chord extensions for richer sound
-        if np.random.random() > 0.6:  # 40% chance
-            extension = root_midi + 10  # Major 7th
+        if rng.random() > 0.6:  # 40% chance
+            extension = int(root_midi[w]) + 10  # Major 7th
             if extension <= 84:
                 chord_notes.append(extension)
 
-        # Dynamic velocities based on energy and position
-        base_vel = int(70 + avg_energy.mean() * 20)
-        spread = 15
-        velocities = [int(np.clip(base_vel + np.random.randint(-spread, spread + 1), 40, 120)) for _ in chord_notes]
+        vel = int(base_vel[w])
+        velocities = [int(np.clip(vel + rng.randint(-spread, spread + 1), 40, 120)) for _ in chord_notes]
 
         # Emit chord with dynamic timing
-        first = True
-        for note, vel in zip(chord_notes, velocities):
-            track.append(Message('note_on', channel=0, note=int(note), velocity=vel, time=0 if not first else 0))
-            first = False
+        for note, velocity in zip(chord_notes, velocities):
+            track.append(Message('note_on', channel=0, note=note, velocity=velocity, time=0))
 
         # Vary chord duration slightly
-        duration_variation = np.random.randint(-20, 21)
+        duration_variation = rng.randint(-20, 21)
         actual_ticks = max(60, chord_ticks + duration_variation)
-        
+
         first_off = True
         for note in chord_notes:
-            track.append(Message('note_off', channel=0, note=int(note), velocity=64, time=actual_ticks if first_off else 0))
+            track.append(Message('note_off', channel=0, note=note, velocity=64, time=actual_ticks if first_off else 0))
             first_off = False
 
-        prev_root = root_midi
-
     return mid
 
-def get_real_seed():
-    """Get a real chord progression segment as seed instead of random noise."""
+def midi_to_bytes(midi_file):
+    """Serialize a MidiFile to bytes in memory, without touching the filesystem."""
+    buffer = io.BytesIO()
+    midi_file.save(file=buffer)
+    return buffer.getvalue()
+
+def get_real_seed(rng=None, generator=None):
+    """Get a real chord progression segment as seed instead of random noise.
+
+    rng (random.Random) picks the window and generator (torch.Generator)
+    drives the noise fallback; both default to the global generators.
+    """
+    pool = get_seed_pool(METADATA_CSV, CORPUS_PATH)
+    if pool.available:
+        seed_data = pool.sample(SEED_LENGTH, rng=rng)
+        return torch.from_numpy(seed_data).unsqueeze(0)  # (1, SEED_LENGTH, n_mels)
+
+    # Fallback to random if real data is unavailable
+    pool.record_fallback(pool.error)
+    return torch.randn(1, SEED_LENGTH, 64, generator=generator) * 0.1
+
+def iter_rollout(model, temperatures, seed_length=SEED_LENGTH, total_length=TOTAL_LENGTH, seed=None, chunk_frames=1,
+                 timer=None, deadline=None):
+    """Roll out one candidate per temperature, yielding as frames are produced.
+
+    Yields (generated, n_frames): generated is the (N, total_length, n_mels)
+    rollout buffer as a NumPy view and n_frames how many leading frames are
+    filled. The first yield comes right after seeding, then every
+    chunk_frames new frames, and always once at the end. The buffer is
+    written in place, so copy any slice you keep past the next step.
+    At any yield after the first, the caller may send() a list of candidate
+    indices to keep; the others are dropped and the rollout continues with
+    only the survivors (the next buffer is a new, smaller array).
+    With an integer seed the rollout is reproducible: seed windows and noise
+    come from private generators instead of the global ones.
+    deadline (a Deadline) is checked before every step; once it has expired
+    the rollout yields the frames filled so far (if it hasn't just done so)
+    and stops, so the last n_frames is below total_length.
+
+    Stage timings go into timer (a metrics.RolloutTimer); without one they
+    are published to the process-wide metrics when the rollout ends.
+    """
+    if timer is not None:
+        yield from _rollout_frames(model, temperatures, seed_length, total_length, seed, chunk_frames, timer, deadline)
+        return
+    timer = RolloutTimer()
     try:
-        # Load metadata to get available files
-        with open(METADATA_CSV, 'r') as f:
-            lines = f.readlines()[1:]  # Skip header
-            random_file = random.choice(lines).strip().split(',')[2]  # Get feature_path
-        
-        # Load real data
-        real_data = np.load(random_file)
-        
-        # Pick a random segment
-        if real_data.shape[1] > SEED_LENGTH:
-            start_idx = random.randint(0, real_data.shape[1] - SEED_LENGTH)
-            seed_data = real_data[:, start_idx:start_idx+SEED_LENGTH]
-        else:
-            # Pad if too short
-            seed_data = np.pad(real_data, ((0, 0), (0, SEED_LENGTH - real_data.shape[1])), mode='constant')
-        
-        return torch.tensor(seed_data.T, dtype=torch.float32).unsqueeze(0)  # (1, SEED_LENGTH, n_mels)
-    except:
-        # Fallback to random if real data fails
-        return torch.randn(1, SEED_LENGTH, 64) * 0.1
+        yield from _rollout_frames(model, temperatures, seed_length, total_length, seed, chunk_frames, timer, deadline)
+    finally:
+        timer.publish()
+
+
+@torch.no_grad()
+def _rollout_frames(model, temperatures, seed_length, total_length, seed, chunk_frames, timer, deadline):
+    step = rollout_step(model)
+    n_candidates = len(temperatures)
+    rng, generator = None, None
+    if seed is not None:
+        rng = random.Random(seed)
+        generator = torch.Generator().manual_seed(seed)
+
+    def randn_like(frame):
+        return torch.randn(frame.shape, dtype=frame.dtype, generator=generator)
+
+    model.eval()
+    timer.n_candidates = n_candidates
+    # One real seed per candidate, stacked along the batch dimension
+    start = time.perf_counter()
+    seed_frames = torch.cat([get_real_seed(rng, generator) for _ in range(n_candidates)], dim=0)
+    timer.seed_s += time.perf_counter() - start
+    n_seed = seed_frames.shape[1]
+    n_steps = total_length - seed_length
+
+    # Preallocated rollout buffer: new frames are written in place, so a
+    # rollout costs O(total_length) instead of re-copying on every step
+    generated = seed_frames.new_empty((n_candidates, n_seed + n_steps, seed_frames.shape[2]))
+    generated[:, :n_seed] = seed_frames
+    frames = generated.numpy()
+    yield frames, n_seed
+
+    # Per-candidate temperature, broadcast over (time, mel) of each frame
+    temps = torch.tensor(temperatures, dtype=seed_frames.dtype).view(n_candidates, 1, 1)
+
+    # Prime the recurrent state on all but the last seed frame; the loop
+    # then feeds one frame per step and carries the state forward
+    # (h for RNN/GRU backbones, (h, c) for LSTMs)
+    hidden = None
+    if n_seed > 1:
+        start = time.perf_counter()
+        _, hidden = step(seed_frames[:, :-1, :], None)
+        timer.model_s += time.perf_counter() - start
+
+    # Generate new timesteps with aggressive variation
+    for i in range(n_steps):
+        pos = n_seed + i
+        if deadline is not None and deadline.expired():
+            # Frames up to pos were already yielded when i lands on a chunk boundary
+            if i % chunk_frames:
+                yield frames, pos
+            return
+        last_input = generated[:, pos - 1:pos, :]
+        start = time.perf_counter()
+        next_frame, hidden = step(last_input, hidden)
+        stepped = time.perf_counter()
+        timer.step_s.append(stepped - start)
+        timer.model_s += stepped - start
+
+        # Much higher noise for maximum variation
+        noise = randn_like(next_frame) * temps * 0.3
+        next_frame = next_frame + noise
+
+        # Minimal smoothing for maximum change
+        next_frame = next_frame * 0.98 + last_input * 0.02
+
+        # Frequent "surprise" variations
+        if i % 8 == 0:  # Every 8 timesteps (more frequent)
+            surprise = randn_like(next_frame) * temps * 0.4
+            next_frame = next_frame + surprise
+
+        # Add harmonic jumps every 15 timesteps
+        if i % 15 == 0:
+            harmonic_jump = randn_like(next_frame) * temps * 0.5
+            next_frame = next_frame + harmonic_jump
+
+        # Add rhythmic variations every 12 timesteps
+        if i % 12 == 0:
+            rhythmic_variation = randn_like(next_frame) * temps * 0.2
+            next_frame = next_frame + rhythmic_variation
+
+        generated[:, pos:pos + 1, :] = next_frame
+        timer.noise_s += time.perf_counter() - stepped
+        if (i + 1) % chunk_frames == 0 or i + 1 == n_steps:
+            keep = yield frames, pos + 1
+            if keep is not None:
+                keep = torch.as_tensor(keep, dtype=torch.long)
+                generated = generated.index_select(0, keep)
+                frames = generated.numpy()
+                temps = temps.index_select(0, keep)
+                hidden = select_hidden(hidden, keep)
+
+
+def select_hidden(hidden, index):
+    """Keep the given batch entries of a recurrent state (h, or (h, c) for LSTMs)."""
+    if isinstance(hidden, tuple):
+        return tuple(h.index_select(1, index) for h in hidden)
+    return hidden.index_select(1, index)
+
+
+def generate_batch(model, temperatures, seed_length=SEED_LENGTH, total_length=TOTAL_LENGTH, seed=None, timer=None,
+                   deadline=None):
+    """Generate one sequence per temperature, rolling all candidates out in lockstep.
+
+    Returns an array of shape (N, total_length, n_mels) with N = len(temperatures).
+    Pass an integer seed for a reproducible result. If deadline expires
+    first, the sequences are cut to the frames generated so far.
+    """
+    for frames, n_frames in iter_rollout(model, temperatures, seed_length, total_length, seed=seed,
+                                         chunk_frames=total_length, timer=timer, deadline=deadline):
+        pass
+    return frames[:, :n_frames]
 
 def generate_single(model, temperature=0.8, seed_length=SEED_LENGTH, total_length=TOTAL_LENGTH):
     """Generate a single sequence with maximum variation and musical progression."""
-    backbone, head = model[0], model[1]
-    Hin = backbone.input_size
-    
-    model.eval()
-    with torch.no_grad():
-        # Use real seed data
-        generated = get_real_seed()
-        
-        # Generate new timesteps with aggressive variation
-        for i in range(total_length - seed_length):
-            last_input = generated[:, -1:, :]
-            output, _ = backbone(last_input)
-            next_frame = head(output)
-            
-            # Much higher noise for maximum variation
-            noise = torch.randn_like(next_frame) * temperature * 0.3
-            next_frame = next_frame + noise
-            
-            # Minimal smoothing for maximum change
-            next_frame = next_frame * 0.98 + last_input * 0.02
-            
-            # Frequent "surprise" variations
-            if i % 8 == 0:  # Every 8 timesteps (more frequent)
-                surprise = torch.randn_like(next_frame) * temperature * 0.4
-                next_frame = next_frame + surprise
-            
-            # Add harmonic jumps every 15 timesteps
-            if i % 15 == 0:
-                harmonic_jump = torch.randn_like(next_frame) * temperature * 0.5
-                next_frame = next_frame + harmonic_jump
-            
-            # Add rhythmic variations every 12 timesteps
-            if i % 12 == 0:
-                rhythmic_variation = torch.randn_like(next_frame) * temperature * 0.2
-                next_frame = next_frame + rhythmic_variation
-            
-            generated = torch.cat([generated, next_frame], dim=1)
-    
-    return generated.squeeze(0).numpy()
+    return generate_batch(model, [temperature], seed_length=seed_length, total_length=total_length)[0]
+
+def best_of_n(model, temperatures, seed_length=SEED_LENGTH, total_length=TOTAL_LENGTH, seed=None):
+    """Roll out one candidate per temperature and keep the best-scoring one.
+
+    Returns (best_sequence, best_score, scores).
+    """
+    sequences = generate_batch(model, temperatures, seed_length=seed_length, total_length=total_length, seed=seed)
+    with timed('score'):
+        scores = evaluate_sequence_quality(sequences)
+    best_index = int(np.argmax(scores))
+    return sequences[best_index], scores[best_index], scores
+
+def halving_rungs(n_candidates, n_steps, eta=2, min_steps=10):
+    """Generated-frame counts at which successive halving prunes.
+
+    Each rung keeps 1/eta of the candidates and lets the survivors run eta
+    times longer, finishing at n_steps. Rungs stop before a candidate would
+    be judged on fewer than min_steps generated frames.
+    """
+    halvings = 0
+    while eta ** (halvings + 1) <= n_candidates and n_steps / eta ** (halvings + 1) >= min_steps:
+        halvings += 1
+    return [int(round(n_steps / eta ** k)) for k in range(halvings, 0, -1)]
+
+def successive_halving(model, temperatures, seed_length=SEED_LENGTH, total_length=TOTAL_LENGTH, seed=None,
+                       eta=2, min_steps=10, timer=None, deadline=None):
+    """Best-of-N with early stopping: score partial rollouts and keep extending only the leaders.
+
+    All candidates start together. At each rung (see halving_rungs) the
+    partial sequences are scored with evaluate_sequence_quality and the top
+    1/eta continue. Returns (best_sequence, best_score, search), where
+    search reports the surviving candidates, their final scores and the
+    candidate-frames generated versus a full best-of-N. If deadline expires
+    first, the survivors so far are scored on the frames they have, the best
+    partial sequence is returned and search['truncated'] is True.
+    """
+    return successive_halving_groups(model, temperatures, [(len(temperatures), deadline)], seed_length,
+                                     total_length, seed=seed, eta=eta, min_steps=min_steps, timer=timer)[0]
+
+def _halving_result(frames, alive, n_candidates, frames_generated, n_steps, steps_done):
+    # frames holds the survivors' filled frames; the best one is copied out of the rollout buffer
+    with timed('score'):
+        scores = evaluate_sequence_quality(frames)
+    best = int(np.argmax(scores))
+    search = {
+        'candidates': n_candidates,
+        'survivors': alive,
+        'scores': scores,
+        'best_candidate': alive[best],
+        'frames_generated': frames_generated,
+        'frames_full': n_candidates * n_steps,
+        'truncated': steps_done < n_steps,
+    }
+    return frames[best].copy(), scores[best], search
+
+def successive_halving_groups(model, temperatures, groups, seed_length=SEED_LENGTH, total_length=TOTAL_LENGTH,
+                              seed=None, eta=2, min_steps=10, timer=None, on_expired=None):
+    """Several independent successive-halving searches sharing one rollout.
+
+    groups lists (n_candidates, deadline or None) per search, in the order
+    of temperatures. Each search prunes only its own candidates, at its own
+    rungs, so searches of different sizes can share a batch. When a search's deadline expires it is scored on
+    the frames it has, dropped from the rollout and on_expired(group index,
+    result) is called. Returns one (best_sequence, best_score, search) per
+    group (see successive_halving), or None for groups handed to on_expired.
+    """
+    rollout = iter_rollout(model, temperatures, seed_length, total_length, seed=seed, timer=timer)
+    frames, n_seed = next(rollout)
+    n_steps = frames.shape[1] - n_seed
+    alive = [list(range(n)) for n, _ in groups]
+    rungs = [[n_seed + r for r in halving_rungs(n, n_steps, eta, min_steps)] for n, _ in groups]
+    frames_generated = [0] * len(groups)
+    results = [None] * len(groups)
+    live = list(range(len(groups)))  # Searches still rolling out, in batch order
+    previous = n_seed
+    keep = None
+    while True:
+        try:
+            frames, n_frames = rollout.send(keep)
+        except StopIteration:
+            if keep is not None:
+                # The rollout ended right after a rung; prune the last buffer here
+                frames = frames[keep]
+            break
+        keep = None
+        rows, start, changed = [], 0, False
+        for g in list(live):
+            n, deadline = len(alive[g]), groups[g][1]
+            frames_generated[g] += n * (n_frames - previous)
+            if deadline is not None and deadline.expired():
+                results[g] = _halving_result(frames[start:start + n, :n_frames], alive[g], groups[g][0],
+                                             frames_generated[g], n_steps, n_frames - n_seed)
+                if on_expired is not None:
+                    on_expired(g, results[g])
+                    results[g] = None
+                live.remove(g)
+                changed = True
+            elif rungs[g] and n_frames == rungs[g][0]:
+                rungs[g].pop(0)
+                with timed('score'):
+                    partial = evaluate_sequence_quality(frames[start:start + n, :n_frames])
+                # Stable order so ties (and a seeded search) resolve deterministically
+                survivors = np.sort(np.argsort(-partial, kind='stable')[:max(1, n // eta)]).tolist()
+                alive[g] = [alive[g][i] for i in survivors]
+                rows.extend(start + i for i in survivors)
+                changed = True
+            else:
+                rows.extend(range(start, start + n))
+            start += n
+        previous = n_frames
+        if not live:
+            rollout.close()
+            return results
+        if changed:
+            keep = rows
+
+    start = 0
+    for g in live:
+        n = len(alive[g])
+        results[g] = _halving_result(frames[start:start + n, :previous], alive[g], groups[g][0],
+                                     frames_generated[g], n_steps, previous - n_seed)
+        start += n
+    return results
 
 def evaluate_sequence_quality(sequence):
-    """Quality score that rewards variation and musical richness"""
+    """Quality score that rewards variation and musical richness.
+
+    Accepts a single (T, n_mels) sequence and returns its score, or a stacked
+    (N, T, n_mels) batch and returns an array of N scores in one pass.
+    """
+    sequence = np.asarray(sequence)
+    if sequence.ndim == 2:
+        return evaluate_sequence_quality(sequence[np.newaxis])[0]
+
+    n_candidates = sequence.shape[0]
+    flat = sequence.reshape(n_candidates, -1)
+
+    # Frame-to-frame differences, shared by every term below
+    diffs = np.diff(sequence, axis=1)
+    flat_diffs = diffs.reshape(n_candidates, -1)
+
     # Calculate smoothness (but don't over-penalize)
-    smoothness = -np.mean(np.std(np.diff(sequence, axis=0), axis=0)) * 0.5
-    
+    smoothness = -np.mean(np.std(diffs, axis=1), axis=1) * 0.5
+
     # Calculate harmonic richness (energy distribution)
-    energy_per_bin = np.mean(sequence, axis=0)
-    harmonic_richness = np.sum(energy_per_bin > np.percentile(energy_per_bin, 70))
-    
+    energy_per_bin = np.mean(sequence, axis=1)
+    threshold = np.percentile(energy_per_bin, 70, axis=1, keepdims=True)
+    harmonic_richness = np.sum(energy_per_bin > threshold, axis=1)
+
     # Calculate dynamic range
-    dynamic_range = np.max(sequence) - np.min(sequence)
-    
+    dynamic_range = np.max(flat, axis=1) - np.min(flat, axis=1)
+
     # Reward variation (higher variation = better)
-    variation_score = np.std(np.diff(sequence, axis=0)) * 0.3
-    
+    variation_score = np.std(flat_diffs, axis=1) * 0.3
+
     # Reward chord changes (count significant energy shifts)
-    energy_changes = np.sum(np.abs(np.diff(sequence, axis=0)) > np.std(sequence) * 0.5)
+    change_threshold = np.std(flat, axis=1, keepdims=True) * 0.5
+    energy_changes = np.sum(np.abs(flat_diffs) > change_threshold, axis=1)
     change_bonus = energy_changes * 0.01
-    
+
     # Combined score (variation is now rewarded)
     score = smoothness + harmonic_richness * 0.1 + dynamic_range * 0.01 + variation_score + change_bonus
     return score
@@ -240,23 +621,32 @@ def temperature_for_attempt(attempt_index: int) -> float:
     return 1.0 + attempt_index * 0.6
 
 
-def generate():
-    """Generate from trained model with quality improvements."""
-    model = torch.load(CHECKPOINT_PATH, map_location='cpu', weights_only=False)
+def generate(model=None, search='halving'):
+    """Generate from trained model with quality improvements.
+
+    search='halving' prunes weak attempts partway (successive_halving);
+    search='full' rolls every attempt out to full length.
+    """
+    if model is None:
+        model = load_rollout_model()
 
     print("Generating multiple sequences and selecting best...")
-    best_sequence = None
-    best_score = -float('inf')
-
-    for attempt in range(N_ATTEMPTS):
-        print(f"Attempt {attempt + 1}/{N_ATTEMPTS}")
-        temperature = temperature_for_attempt(attempt)
-        sequence = generate_single(model, temperature=temperature, seed_length=SEED_LENGTH, total_length=TOTAL_LENGTH)
-        score = evaluate_sequence_quality(sequence)
-        print(f"  Temperature: {temperature:.1f}, Score: {score:.3f}")
-        if score > best_score:
-            best_sequence = sequence
-            best_score = score
+
+    # Roll out every attempt at once, each with its own scheduled temperature
+    temperatures = [temperature_for_attempt(attempt) for attempt in range(N_ATTEMPTS)]
+    if search == 'halving':
+        best_sequence, best_score, result = successive_halving(
+            model, temperatures, seed_length=SEED_LENGTH, total_length=TOTAL_LENGTH
+        )
+        for attempt, score in zip(result['survivors'], result['scores']):
+            print(f"Attempt {attempt + 1}/{N_ATTEMPTS} (survived pruning)")
+            print(f"  Temperature: {temperatures[attempt]:.1f}, Score: {score:.3f}")
+        print(f"Generated {result['frames_generated']} of {result['frames_full']} candidate frames")
+    else:
+        best_sequence, best_score, scores = best_of_n(model, temperatures, seed_length=SEED_LENGTH, total_length=TOTAL_LENGTH)
+        for attempt, (temperature, score) in enumerate(zip(temperatures, scores)):
+            print(f"Attempt {attempt + 1}/{N_ATTEMPTS}")
+            print(f"  Temperature: {temperature:.1f}, Score: {score:.3f}")
 
     print(f"Best sequence score: {best_score:.3f}")
     ensure_dir(OUTPUT_DIR)
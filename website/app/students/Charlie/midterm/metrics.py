@@ -0,0 +1,191 @@
+"""Minimal in-process metrics with Prometheus text exposition.
+
+Counters, gauges and histograms register themselves with REGISTRY, and
+render() produces the text format served on /api/metrics. Collectors can
+add values computed at scrape time (cache and serving counters, for
+example).
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Buckets for whole stages (seconds) and for single rollout steps (~50us-50ms)
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STEP_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=(), registry=None):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_child(key, value))
+        return lines
+
+    def _render_child(self, key, value):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=STAGE_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help_text, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            child = self._values.get(key)
+            if child is None:
+                # [per-bucket counts..., +Inf count, sum]
+                child = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            child[index] += 1
+            child[-1] += value
+
+    def _render_child(self, key, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), child[:-1]):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, ('le', _format_value(bound)))
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f'{self.name}_sum{labels} {_format_value(child[-1])}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def add_collector(self, collect):
+        """collect() returns [(name, kind, help, [(labels_dict, value), ...]), ...] at scrape time."""
+        self._collectors.append(collect)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            for name, kind, help_text, samples in collect():
+                lines.extend([f'# HELP {name} {help_text}', f'# TYPE {name} {kind}'])
+                for labels, value in samples:
+                    labelnames = tuple(labels)
+                    lines.append(f'{name}{_format_labels(labelnames, [labels[k] for k in labelnames])} '
+                                 f'{_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = Histogram(
+    'generation_stage_seconds', 'Time spent in each stage of the generation pipeline', ['stage'])
+ROLLOUT_STEP_SECONDS = Histogram(
+    'generation_rollout_step_seconds', 'Latency of one backbone + head rollout step (whole batch)',
+    buckets=STEP_BUCKETS)
+ROLLOUT_CANDIDATES = Histogram(
+    'generation_rollout_candidates', 'Candidates rolled out together in one batch',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+HTTP_REQUESTS = Counter('http_requests_total', 'HTTP requests by endpoint and status', ['endpoint', 'status'])
+HTTP_REQUEST_SECONDS = Histogram('http_request_seconds', 'HTTP request latency by endpoint', ['endpoint'])
+MODEL_LOAD_SECONDS = Gauge('model_load_seconds', 'Model load and warm-up time at startup', ['phase'])
+GENERATIONS_TRUNCATED = Counter(
+    'generation_truncated_total', 'Generations cut short by their max_latency_ms deadline', ['endpoint'])
+
+
+@contextmanager
+def timed(stage):
+    """Record the duration of a block under generation_stage_seconds{stage=...}."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+class RolloutTimer:
+    """Timings of one rollout, published to the histograms in one go.
+
+    A plain-data object, so pool workers can send theirs back to the serving
+    process (as_dict / from_dict) to be published there.
+    """
+
+    def __init__(self, n_candidates=0, seed_s=0.0, model_s=0.0, noise_s=0.0, step_s=None):
+        self.n_candidates = n_candidates
+        self.seed_s = seed_s
+        self.model_s = model_s
+        self.noise_s = noise_s
+        self.step_s = step_s if step_s is not None else []
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def publish(self):
+        ROLLOUT_CANDIDATES.observe(self.n_candidates)
+        STAGE_SECONDS.observe(self.seed_s, stage='seed')
+        STAGE_SECONDS.observe(self.model_s, stage='model')
+        STAGE_SECONDS.observe(self.noise_s, stage='noise')
+        for step_s in self.step_s:
+            ROLLOUT_STEP_SECONDS.observe(step_s)
@@ -0,0 +1,175 @@
+"""Chord pattern analysis with an Aho-Corasick automaton over normalized chord tokens.
+
+A progression is tokenized as alternating quality and interval symbols:
+
+    Dm7 G7 Cmaj7  ->  ('q', 'm7') ('i', 5) ('q', '7') ('i', 5) ('q', 'maj7')
+
+Intervals are root movements in semitones (mod 12), so the tokens don't
+depend on the key and one compiled pattern matches in all twelve keys.
+Every pattern in the library is compiled into a single automaton and a
+progression is scanned once, whatever the number of patterns.
+"""
+import json
+import os
+from collections import deque
+
+NOTE_NAMES = ['C', 'Db', 'D', 'Eb', 'E', 'F', 'Gb', 'G', 'Ab', 'A', 'Bb', 'B']
+NATURALS = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+
+# Spellings of the same chord quality, mapped to one canonical name
+QUALITY_ALIASES = {
+    '': 'maj', 'M': 'maj', 'maj': 'maj',
+    'm': 'm', 'min': 'm', '-': 'm',
+    'maj7': 'maj7', 'M7': 'maj7', 'Maj7': 'maj7', 'Δ': 'maj7', 'Δ7': 'maj7', 'ma7': 'maj7',
+    'm7': 'm7', 'min7': 'm7', '-7': 'm7', 'mi7': 'm7',
+    '7': '7', 'dom7': '7',
+    'm7b5': 'm7b5', 'ø': 'm7b5', 'ø7': 'm7b5', '-7b5': 'm7b5', 'min7b5': 'm7b5',
+    'dim': 'dim', 'o': 'dim', 'dim7': 'dim7', 'o7': 'dim7',
+    'mMaj7': 'mmaj7', 'mM7': 'mmaj7', 'm(maj7)': 'mmaj7', '-Δ7': 'mmaj7',
+    '6': '6', 'm6': 'm6', '9': '9', 'maj9': 'maj9', 'm9': 'm9', '13': '13',
+    'sus2': 'sus2', 'sus4': 'sus4', 'sus': 'sus4', '7sus4': '7sus4',
+    '7#5': '7#5', '+7': '7#5', 'aug': 'aug', '+': 'aug', '7b9': '7b9', '7#9': '7#9',
+}
+
+DEFAULT_PATTERNS_PATH = os.path.join(os.path.dirname(__file__), 'patterns.json')
+
+
+def parse_chord(symbol):
+    """Split a chord symbol into (root pitch class, canonical quality), or None if unparseable."""
+    symbol = symbol.strip()
+    if not symbol or symbol[0].upper() not in NATURALS:
+        return None
+    root = NATURALS[symbol[0].upper()]
+    rest = symbol[1:]
+    while rest[:1] in ('#', 'b', '♯', '♭'):
+        root += 1 if rest[0] in ('#', '♯') else -1
+        rest = rest[1:]
+    rest = rest.split('/')[0]  # Ignore slash bass notes
+    quality = QUALITY_ALIASES.get(rest)
+    if quality is None:
+        return None
+    return root % 12, quality
+
+
+def tokenize(chords):
+    """Alternating quality/interval tokens for a progression (2 * len(chords) - 1 tokens).
+
+    Unparseable chords get tokens that match nothing, so no pattern spans them.
+    """
+    parsed = [parse_chord(chord) for chord in chords]
+    tokens = []
+    for i, chord in enumerate(parsed):
+        if i > 0:
+            previous = parsed[i - 1]
+            if previous is None or chord is None:
+                tokens.append(('i', None, i))
+            else:
+                tokens.append(('i', (chord[0] - previous[0]) % 12))
+        tokens.append(('q', chord[1]) if chord is not None else ('q', None, i))
+    return tokens, parsed
+
+
+class PatternLibrary:
+    """A set of named chord patterns compiled into one Aho-Corasick automaton.
+
+    Patterns are written in any key (the library's JSON uses C); matches are
+    reported in whatever key they occur, with 'key' naming the transposed tonic.
+    """
+
+    def __init__(self, patterns=None):
+        self.patterns = []      # [(name, chords, tonic pitch class, first root pitch class), ...]
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]     # Pattern indices ending at each state
+        self._compiled = True
+        for name, spec in (patterns or {}).items():
+            self.add(name, spec)
+        self._compile()
+
+    def add(self, name, spec):
+        """Add a pattern given as a chord list or {'chords': [...], 'tonic': 'C'}."""
+        if isinstance(spec, dict):
+            chords, tonic = spec['chords'], spec.get('tonic', 'C')
+        else:
+            chords, tonic = spec, 'C'
+        tokens, parsed = tokenize(chords)
+        if not chords or any(chord is None for chord in parsed):
+            raise ValueError(f"Pattern {name!r} has chords that can't be parsed: {chords}")
+        tonic_parsed = parse_chord(tonic)
+        if tonic_parsed is None:
+            raise ValueError(f"Pattern {name!r} has an invalid tonic {tonic!r}")
+
+        index = len(self.patterns)
+        self.patterns.append((name, list(chords), tonic_parsed[0], parsed[0][0]))
+        state = 0
+        for token in tokens:
+            child = self._goto[state].get(token)
+            if child is None:
+                child = len(self._goto)
+                self._goto[state][token] = child
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = child
+        self._output[state].append(index)
+        self._compiled = False
+
+    def _compile(self):
+        """Breadth-first pass filling failure links and merged outputs."""
+        queue = deque()
+        for state in self._goto[0].values():
+            self._fail[state] = 0
+            queue.append(state)
+        while queue:
+            state = queue.popleft()
+            for token, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and token not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(token, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+        self._compiled = True
+
+    def find(self, chords):
+        """Return every pattern occurrence in a progression, in one linear scan."""
+        if not self._compiled:
+            self._compile()
+        tokens, parsed = tokenize(chords)
+        found = []
+        state = 0
+        for position, token in enumerate(tokens):
+            while state and token not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(token, 0)
+            for index in self._output[state]:
+                name, pattern_chords, tonic, first_root = self.patterns[index]
+                length = len(pattern_chords)
+                start = (position - (2 * length - 2)) // 2
+                transposition = (parsed[start][0] - first_root) % 12
+                found.append({
+                    'name': name,
+                    'start': start,
+                    'length': length,
+                    'chords': list(chords[start:start + length]),
+                    'key': NOTE_NAMES[(tonic + transposition) % 12],
+                })
+        found.sort(key=lambda match: (match['start'], -match['length']))
+        return found
+
+    def describe(self):
+        return {
+            'patterns': len(self.patterns),
+            'states': len(self._goto),
+        }
+
+
+def load_pattern_library(*paths):
+    """Build a PatternLibrary from JSON files of {name: chords}; later files override earlier ones."""
+    patterns = {}
+    for path in paths:
+        if not path:
+            continue
+        with open(path, 'r') as f:
+            patterns.update(json.load(f))
+    return PatternLibrary(patterns)
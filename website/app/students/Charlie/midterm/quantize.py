@@ -0,0 +1,260 @@
+"""Reduced-precision inference modes for the rollout model, with a parity check.
+
+    float32   the checkpoint as trained
+    int8      dynamic int8 quantization of the linear layers; an nn.RNN
+              backbone is first unrolled into two Linear projections so its
+              recurrence is quantized too (GRU/LSTM are quantized natively)
+    bfloat16  weights and activations in bfloat16, frames handed back as float32
+
+Rollouts feed their own output back in, so a low-precision model drifts away
+from the float32 trajectory within a few steps even when it is sound. The
+parity check therefore compares what generation produces rather than
+individual frames: per-sequence quality scores, frame mean and std, and the
+mean spectrum over seeded rollouts, each tested for a difference larger than
+seed-to-seed variation explains (two-sample z-scores). It also feeds both
+models the same float32 rollouts and compares their next-frame predictions
+over the generated frames, which catches a model that is simply wrong.
+
+Usage:
+    python quantize.py --precision int8 [--rollouts 4] [--candidates 8]
+"""
+import argparse
+import copy
+import io
+import os
+import sys
+import warnings
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+sys.path.append(os.path.dirname(__file__))
+from generate import (
+    CHECKPOINT_PATH, TOTAL_LENGTH, SEED_LENGTH, evaluate_sequence_quality, generate_batch, rollout_step,
+    temperature_for_attempt
+)
+from metrics import RolloutTimer
+
+PRECISIONS = ('float32', 'int8', 'bfloat16')
+
+# Parity limits: |z| for per-sequence statistics, and the mean z^2 across mel
+# bins for the spectrum (about 1 when the two models generate alike)
+Z_MAX = 3.0
+PROFILE_MAX_MEAN_Z2 = 2.0
+# Teacher-forced next-frame RMS error relative to the float32 predictions' std;
+# int8 and bfloat16 land around 0.02 on the checkpoint
+PREDICTION_MAX_ERROR = 0.05
+
+
+class UnrolledRNN(nn.Module):
+    """nn.RNN rewritten as per-layer input and hidden Linear projections.
+
+    Numerically the same as the RNN it is built from, but made of nn.Linear
+    layers that quantize_dynamic knows how to convert. Inputs are projected
+    for all timesteps at once; only the recurrence loops over time.
+    """
+
+    def __init__(self, rnn):
+        super().__init__()
+        if not isinstance(rnn, nn.RNN) or rnn.bidirectional:
+            raise ValueError(f"UnrolledRNN needs a unidirectional nn.RNN, got {rnn}")
+        self.batch_first = rnn.batch_first
+        self.num_layers = rnn.num_layers
+        self.hidden_size = rnn.hidden_size
+        self.input_size = rnn.input_size
+        self.nonlinearity = rnn.nonlinearity
+        self.input_proj = nn.ModuleList()
+        self.hidden_proj = nn.ModuleList()
+        for layer in range(rnn.num_layers):
+            in_features = rnn.input_size if layer == 0 else rnn.hidden_size
+            input_proj = nn.Linear(in_features, rnn.hidden_size, bias=rnn.bias)
+            hidden_proj = nn.Linear(rnn.hidden_size, rnn.hidden_size, bias=rnn.bias)
+            with torch.no_grad():
+                input_proj.weight.copy_(getattr(rnn, f'weight_ih_l{layer}'))
+                hidden_proj.weight.copy_(getattr(rnn, f'weight_hh_l{layer}'))
+                if rnn.bias:
+                    input_proj.bias.copy_(getattr(rnn, f'bias_ih_l{layer}'))
+                    hidden_proj.bias.copy_(getattr(rnn, f'bias_hh_l{layer}'))
+            self.input_proj.append(input_proj)
+            self.hidden_proj.append(hidden_proj)
+
+    def forward(self, x, hidden=None):
+        activation = torch.tanh if self.nonlinearity == 'tanh' else torch.relu
+        if not self.batch_first:
+            x = x.transpose(0, 1)
+        if hidden is None:
+            hidden = x.new_zeros(self.num_layers, x.shape[0], self.hidden_size)
+        final = []
+        for layer in range(self.num_layers):
+            projected = self.input_proj[layer](x)
+            h = hidden[layer]
+            outputs = []
+            for t in range(x.shape[1]):
+                h = activation(projected[:, t] + self.hidden_proj[layer](h))
+                outputs.append(h)
+            x = torch.stack(outputs, dim=1)
+            final.append(h)
+        if not self.batch_first:
+            x = x.transpose(0, 1)
+        return x, torch.stack(final)
+
+
+class Bfloat16Rollout(nn.Module):
+    """Backbone + head in bfloat16 behind the float32 step interface.
+
+    The recurrent state stays in bfloat16 between steps.
+    """
+
+    def __init__(self, backbone, head):
+        super().__init__()
+        self.backbone = backbone.to(torch.bfloat16)
+        self.head = head.to(torch.bfloat16)
+
+    def forward(self, x, hidden=None):
+        output, hidden = self.backbone(x.to(torch.bfloat16), hidden)
+        return self.head(output).to(x.dtype), hidden
+
+
+def bfloat16_supported():
+    """True if this CPU has native bfloat16 kernels (AVX512-BF16 / AMX)."""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def quantize_model(model, precision):
+    """Return a copy of a [backbone, head] checkpoint set up for the given precision."""
+    if precision not in PRECISIONS:
+        raise ValueError(f"precision must be one of {PRECISIONS}, got {precision!r}")
+    if not isinstance(model, nn.ModuleList):
+        raise ValueError("quantize_model needs the eager [backbone, head] checkpoint, not a TorchScript export")
+    if precision == 'float32':
+        return model
+
+    backbone, head = copy.deepcopy(model[0]), copy.deepcopy(model[1])
+    if precision == 'bfloat16':
+        return Bfloat16Rollout(backbone, head).eval()
+
+    if isinstance(backbone, nn.RNN):
+        backbone = UnrolledRNN(backbone)
+    with warnings.catch_warnings():
+        # torch.ao.quantization is deprecated in favour of torchao but still ships with torch
+        warnings.simplefilter('ignore', DeprecationWarning)
+        warnings.simplefilter('ignore', UserWarning)
+        return torch.ao.quantization.quantize_dynamic(
+            nn.ModuleList([backbone, head]).eval(), {nn.Linear, nn.GRU, nn.LSTM}, dtype=torch.qint8
+        )
+
+
+def weights_bytes(model):
+    """Serialized size of a model's weights, packed int8 included."""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def _rollouts(model, n_rollouts, n_candidates, total_length):
+    temperatures = [temperature_for_attempt(attempt) for attempt in range(n_candidates)]
+    sequences, step_s = [], []
+    for seed in range(n_rollouts):
+        timer = RolloutTimer()
+        sequences.append(generate_batch(model, temperatures, seed_length=SEED_LENGTH, total_length=total_length,
+                                        seed=seed, timer=timer))
+        step_s.extend(timer.step_s)
+    return np.concatenate(sequences), float(np.median(step_s))
+
+
+@torch.no_grad()
+def prediction_error(reference, candidate, sequences):
+    """Relative RMS difference of next-frame predictions on the same input frames (generated part only)."""
+    inputs = torch.from_numpy(np.ascontiguousarray(sequences[:, :-1]))
+    ref_out, _ = rollout_step(reference)(inputs, None)
+    new_out, _ = rollout_step(candidate)(inputs, None)
+    ref_out, new_out = ref_out[:, SEED_LENGTH - 1:], new_out[:, SEED_LENGTH - 1:]
+    return float((new_out - ref_out).pow(2).mean().sqrt() / ref_out.std())
+
+
+def _z(a, b):
+    """Two-sample z-score of the difference in means along axis 0."""
+    se = np.sqrt(a.var(axis=0, ddof=1) / len(a) + b.var(axis=0, ddof=1) / len(b))
+    return (b.mean(axis=0) - a.mean(axis=0)) / np.maximum(se, 1e-12)
+
+
+def parity_report(reference, candidate, n_rollouts=4, n_candidates=8, total_length=TOTAL_LENGTH):
+    """Compare generation from candidate against the float32 reference on the same seeds.
+
+    Returns a dict of statistics, the failed checks under 'failures' and
+    'passed'.
+    """
+    ref_sequences, ref_step_s = _rollouts(reference, n_rollouts, n_candidates, total_length)
+    new_sequences, new_step_s = _rollouts(candidate, n_rollouts, n_candidates, total_length)
+    # Only the generated frames differ; the seed frames are identical by construction
+    ref_frames = ref_sequences[:, SEED_LENGTH:]
+    new_frames = new_sequences[:, SEED_LENGTH:]
+
+    ref_scores = evaluate_sequence_quality(ref_sequences)
+    new_scores = evaluate_sequence_quality(new_sequences)
+    ref_means, new_means = ref_frames.mean(axis=(1, 2)), new_frames.mean(axis=(1, 2))
+    ref_stds, new_stds = ref_frames.std(axis=(1, 2)), new_frames.std(axis=(1, 2))
+    profile_z = _z(ref_frames.mean(axis=1), new_frames.mean(axis=1))
+
+    report = {
+        'sequences': len(ref_sequences),
+        'score_mean': {'float32': float(ref_scores.mean()), 'candidate': float(new_scores.mean())},
+        'score_z': float(_z(ref_scores, new_scores)),
+        'frame_mean': {'float32': float(ref_means.mean()), 'candidate': float(new_means.mean())},
+        'frame_mean_z': float(_z(ref_means, new_means)),
+        'frame_std': {'float32': float(ref_stds.mean()), 'candidate': float(new_stds.mean())},
+        'frame_std_z': float(_z(ref_stds, new_stds)),
+        'profile_mean_z2': float(np.mean(profile_z ** 2)),
+        'prediction_error': prediction_error(reference, candidate, ref_sequences),
+        'step_us': {'float32': ref_step_s * 1e6, 'candidate': new_step_s * 1e6},
+    }
+    failures = [
+        f"{name} differs (z={report[key]:+.2f}, limit {Z_MAX})"
+        for name, key in (('quality score', 'score_z'), ('frame mean', 'frame_mean_z'), ('frame std', 'frame_std_z'))
+        if abs(report[key]) > Z_MAX
+    ]
+    if report['profile_mean_z2'] > PROFILE_MAX_MEAN_Z2:
+        failures.append(f"mean spectrum differs (mean z^2={report['profile_mean_z2']:.2f}, "
+                        f"limit {PROFILE_MAX_MEAN_Z2})")
+    if report['prediction_error'] > PREDICTION_MAX_ERROR:
+        failures.append(f"next-frame predictions differ by {report['prediction_error']:.1%} "
+                        f"(limit {PREDICTION_MAX_ERROR:.0%})")
+    report['failures'] = failures
+    report['passed'] = not failures
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--checkpoint', default=CHECKPOINT_PATH)
+    parser.add_argument('--precision', choices=PRECISIONS[1:], default='int8')
+    parser.add_argument('--rollouts', type=int, default=4, help='seeded rollouts per model')
+    parser.add_argument('--candidates', type=int, default=8, help='candidates per rollout')
+    args = parser.parse_args()
+
+    if args.precision == 'bfloat16' and not bfloat16_supported():
+        print("Note: no native bfloat16 kernels on this CPU; bfloat16 will be emulated and slow")
+    reference = torch.load(args.checkpoint, map_location='cpu', weights_only=False).eval()
+    candidate = quantize_model(reference, args.precision)
+    report = parity_report(reference, candidate, args.rollouts, args.candidates)
+
+    print(f"{'':<22} {'float32':>10} {args.precision:>10} {'z':>7}")
+    print(f"{'mean quality score':<22} {report['score_mean']['float32']:>10.3f} "
+          f"{report['score_mean']['candidate']:>10.3f} {report['score_z']:>+7.2f}")
+    print(f"{'frame mean':<22} {report['frame_mean']['float32']:>10.3f} "
+          f"{report['frame_mean']['candidate']:>10.3f} {report['frame_mean_z']:>+7.2f}")
+    print(f"{'frame std':<22} {report['frame_std']['float32']:>10.3f} "
+          f"{report['frame_std']['candidate']:>10.3f} {report['frame_std_z']:>+7.2f}")
+    print(f"{'step latency (us)':<22} {report['step_us']['float32']:>10.1f} {report['step_us']['candidate']:>10.1f}")
+    print(f"{'weights (KB)':<22} {weights_bytes(reference) / 1024:>10.1f} {weights_bytes(candidate) / 1024:>10.1f}")
+    print(f"mean spectrum: mean z^2 across mel bins {report['profile_mean_z2']:.2f}")
+    print(f"teacher-forced next-frame error: {report['prediction_error']:.2%}")
+    if report['passed']:
+        print("Parity check passed")
+    else:
+        print("Parity check FAILED:\n  " + "\n  ".join(report['failures']))
+        sys.exit(1)
@@ -0,0 +1,242 @@
+"""Model registry: checkpoints published once to shared memory and swapped atomically.
+
+A model version is a checkpoint at a precision. Loading one saves the
+checkpoint's modules to a file under SHARED_DIR (/dev/shm when available),
+and every process that serves it - the API process and any inference
+workers - loads that file with torch.load(mmap=True). The float32 weights
+are then one set of shared pages per server instead of a copy per process.
+
+The registry holds the active version. Requests pin it with acquire() for
+their whole lifetime, so activate() can install a new version at once
+while in-flight requests finish on the old one. A retired version's file
+is removed when its last request releases it.
+"""
+import atexit
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+
+import torch
+
+from generate import RolloutModule, warm_up
+
+SHARED_DIR = os.environ.get('GENERATOR_SHARED_DIR') or os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'mtsf-models')
+MAX_CACHED_MODELS = 2  # Per process: the active version and the one it replaced
+
+# What a worker process needs to load a version: picklable, no tensors
+ModelSpec = namedtuple('ModelSpec', ['version', 'weights_path', 'precision', 'scripted'])
+
+
+class ModelNotLoaded(Exception):
+    """Raised by acquire() before any version is active."""
+
+
+def checkpoint_version(path):
+    """Short content hash identifying the loaded weights."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+_shared_models = OrderedDict()
+_shared_models_lock = threading.Lock()
+
+
+def load_shared_model(spec):
+    """The rollout model for spec in this process, built over the memory-mapped weights.
+
+    float32 models are scripted around the mapped modules, so they keep
+    using the shared pages; int8 and bfloat16 conversions (quantize.py) make
+    their own per-process copy. The last MAX_CACHED_MODELS are kept.
+    """
+    with _shared_models_lock:
+        if spec in _shared_models:
+            _shared_models.move_to_end(spec)
+            return _shared_models[spec]
+
+    model = torch.load(spec.weights_path, map_location='cpu', mmap=True, weights_only=False).eval()
+    if spec.precision != 'float32':
+        # Imported here: quantize.py builds on generate.py, like this module
+        from quantize import quantize_model
+        model = quantize_model(model, spec.precision)
+    elif spec.scripted:
+        try:
+            model = torch.jit.script(RolloutModule(model[0], model[1]))
+        except Exception as e:
+            print(f"WARNING: could not script {type(model[0]).__name__} backbone ({e}); serving it eagerly")
+
+    with _shared_models_lock:
+        _shared_models[spec] = model
+        while len(_shared_models) > MAX_CACHED_MODELS:
+            _shared_models.popitem(last=False)
+    return model
+
+
+class ModelVersion:
+    """One loaded version: its spec for workers, this process's model, and load details."""
+
+    def __init__(self, spec, model, info):
+        self.spec = spec
+        self.model = model
+        self.info = info
+        self.in_flight = 0
+        self.retired = False
+
+    @property
+    def version(self):
+        return self.spec.version
+
+    @property
+    def precision(self):
+        return self.spec.precision
+
+    def describe(self):
+        return dict(self.info, in_flight=self.in_flight, retired=self.retired)
+
+
+class ModelRegistry:
+    def __init__(self, shared_dir=SHARED_DIR):
+        self.shared_dir = shared_dir
+        self.current = None
+        self.swaps = 0
+        self._retiring = []
+        self._published = set()
+        self._lock = threading.Lock()
+        self.swap_lock = threading.Lock()  # Held by whoever is loading a replacement
+        atexit.register(self.close)
+
+    def load(self, checkpoint_path, precision='float32', scripted=True, warm_up_candidates=3):
+        """Publish a checkpoint to shared memory and load it here, without activating it.
+
+        int8 and bfloat16 must pass quantize.parity_report against the
+        float32 weights, or the version falls back to float32.
+        """
+        start = time.perf_counter()
+        version = checkpoint_version(checkpoint_path)
+        weights_path = self._publish(checkpoint_path, version)
+        info = {
+            'version': version,
+            'checkpoint': checkpoint_path,
+            'requested_precision': precision,
+            'parity': None,
+        }
+
+        if precision != 'float32':
+            from quantize import bfloat16_supported, parity_report
+            if precision == 'bfloat16' and not bfloat16_supported():
+                print("WARNING: this CPU has no native bfloat16 kernels; using float32")
+                precision = 'float32'
+            else:
+                spec = ModelSpec(version, weights_path, precision, scripted)
+                reference = torch.load(weights_path, map_location='cpu', mmap=True, weights_only=False).eval()
+                report = parity_report(reference, load_shared_model(spec), n_rollouts=2)
+                info['parity'] = {
+                    'passed': report['passed'],
+                    'failures': report['failures'],
+                    'prediction_error': report['prediction_error'],
+                    'score_mean': report['score_mean'],
+                    'step_us': report['step_us'],
+                }
+                if report['passed']:
+                    print(f"{precision} parity check passed (next-frame error {report['prediction_error']:.2%})")
+                else:
+                    print(f"WARNING: {precision} model failed its parity check "
+                          f"({'; '.join(report['failures'])}); using float32")
+                    precision = 'float32'
+
+        spec = ModelSpec(version, weights_path, precision, scripted)
+        model = load_shared_model(spec)
+        info.update({
+            'precision': precision,
+            'format': 'torchscript' if isinstance(model, torch.jit.ScriptModule) else 'eager',
+            'load_time_s': time.perf_counter() - start,
+            'warmup_time_s': None,
+        })
+        print(f"Model {version} loaded ({info['format']}, {precision}) in {info['load_time_s']:.3f}s")
+        if warm_up_candidates:
+            # Warm up before the version can be activated so its first request doesn't pay for it
+            info['warmup_time_s'] = warm_up(model, n_candidates=warm_up_candidates)
+        return ModelVersion(spec, model, info)
+
+    def register(self, model, version, **info):
+        """Wrap an already-loaded model (no shared weights, so thread-mode serving only)."""
+        spec = ModelSpec(version, None, info.get('precision', 'float32'), False)
+        return ModelVersion(spec, model, dict({'version': version, 'precision': spec.precision}, **info))
+
+    def activate(self, version):
+        """Make version the one new requests get; returns the version it replaced."""
+        with self._lock:
+            previous, self.current = self.current, version
+            version.info['activated_at'] = time.time()
+            if previous is not None and previous is not version:
+                self.swaps += 1
+                previous.retired = True
+                self._retiring.append(previous)
+                self._release_if_idle(previous)
+        return previous
+
+    @contextmanager
+    def acquire(self):
+        """Pin the active version for the duration of a request."""
+        with self._lock:
+            version = self.current
+            if version is None:
+                raise ModelNotLoaded("no model version is active")
+            version.in_flight += 1
+        try:
+            yield version
+        finally:
+            with self._lock:
+                version.in_flight -= 1
+                self._release_if_idle(version)
+
+    def describe(self):
+        with self._lock:
+            return {
+                'current': self.current.describe() if self.current is not None else None,
+                'retiring': [version.describe() for version in self._retiring],
+                'swaps': self.swaps,
+                'shared_dir': self.shared_dir,
+            }
+
+    def close(self):
+        """Remove every weights file this process published."""
+        for path in list(self._published):
+            self._unlink(path)
+
+    def _publish(self, checkpoint_path, version):
+        os.makedirs(self.shared_dir, exist_ok=True)
+        # One file per server process, so servers sharing a host don't remove each other's
+        path = os.path.join(self.shared_dir, f"{version}-{os.getpid()}.pt")
+        if path not in self._published:
+            checkpoint = torch.load(checkpoint_path, map_location='cpu', weights_only=False)
+            tmp_path = f"{path}.tmp"
+            torch.save(checkpoint, tmp_path)
+            os.replace(tmp_path, path)
+            self._published.add(path)
+        return path
+
+    def _release_if_idle(self, version):
+        # Called with self._lock held
+        if not version.retired or version.in_flight or version not in self._retiring:
+            return
+        self._retiring.remove(version)
+        path = version.spec.weights_path
+        still_used = self.current is not None and self.current.spec.weights_path == path
+        if path is not None and not still_used and not any(v.spec.weights_path == path for v in self._retiring):
+            # Workers that mapped the file keep their pages until they drop the model
+            self._unlink(path)
+
+    def _unlink(self, path):
+        self._published.discard(path)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
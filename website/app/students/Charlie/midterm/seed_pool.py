@@ -0,0 +1,163 @@
+import csv
+import os
+import random
+import threading
+
+import numpy as np
+
+from corpus import Corpus, CorpusError, read_feature_paths
+
+
+class SeedPool:
+    """Index of the real-data seed corpus that serves random windows.
+
+    When a packed corpus (see corpus.py) exists and is newer than the
+    metadata CSV, windows are read from its single memory map. Otherwise the
+    metadata CSV is parsed once into a list of (feature_path, n_frames)
+    entries and each feature file is opened with ``mmap_mode='r'``. Either
+    way, drawing a seed only reads the requested window, and the same rng
+    draws pick the same window from both sources.
+    """
+
+    def __init__(self, metadata_csv, corpus_path=None):
+        self.metadata_csv = metadata_csv
+        self.corpus_path = corpus_path
+        self.corpus = None
+        self.source = None       # 'corpus' or 'metadata' once indexed
+        self.entries = []        # [(feature_path, n_frames), ...]
+        self.skipped = []        # [(feature_path, reason), ...]
+        self.error = None        # Why the pool is empty, if it is
+        self.samples_served = 0
+        self.fallbacks = 0
+        self._arrays = {}
+        self._lock = threading.Lock()
+        if not self._open_corpus():
+            self._build_index()
+
+    def _open_corpus(self):
+        """Use the packed corpus if there is a current one; returns True if it is in use."""
+        if not self.corpus_path or not os.path.exists(self.corpus_path):
+            return False
+        if os.path.exists(self.metadata_csv) and \
+                os.path.getmtime(self.corpus_path) < os.path.getmtime(self.metadata_csv):
+            print(f"WARNING: {self.corpus_path} is older than {self.metadata_csv}; "
+                  f"re-run corpus.py pack. Reading the feature files directly.")
+            return False
+        try:
+            corpus = Corpus(self.corpus_path)
+        except CorpusError as e:
+            print(f"WARNING: {e}; reading the feature files directly")
+            return False
+        if not len(corpus):
+            return False
+        self.corpus = corpus
+        self.source = 'corpus'
+        self.entries = [(name, int(n_frames)) for name, n_frames in zip(corpus.names, corpus.index['frames'])]
+        return True
+
+    def _build_index(self):
+        try:
+            paths = read_feature_paths(self.metadata_csv)
+        except (OSError, csv.Error) as e:
+            self.error = f"could not read {self.metadata_csv}: {e}"
+            return
+
+        for path in paths:
+            try:
+                # Only the .npy header is read here; data pages load on demand
+                features = np.load(path, mmap_mode='r')
+            except (OSError, ValueError) as e:
+                self.skipped.append((path, str(e)))
+                continue
+            if features.ndim != 2:
+                self.skipped.append((path, f"expected (n_mels, frames), got shape {features.shape}"))
+                continue
+            self._arrays[path] = features
+            self.entries.append((path, features.shape[1]))
+
+        if not self.entries:
+            self.error = f"no usable feature files listed in {self.metadata_csv}"
+        else:
+            self.source = 'metadata'
+
+    @property
+    def available(self):
+        return bool(self.entries)
+
+    def sample(self, seed_length, rng=None):
+        """Return a random (seed_length, n_mels) float32 window from the corpus.
+
+        Pass a random.Random as rng for reproducible draws; the default is the
+        module-level random generator.
+        """
+        if not self.entries:
+            raise RuntimeError(self.error)
+
+        rng = rng or random
+        if self.corpus is not None:
+            # One copy out of the shared map, converting float16 storage to float32
+            window = np.array(self.corpus.random_window(seed_length, rng), dtype=np.float32)
+            with self._lock:
+                self.samples_served += 1
+            return window
+
+        path, n_frames = rng.choice(self.entries)
+        features = self._arrays[path]
+
+        # Pick a random segment
+        if n_frames > seed_length:
+            start_idx = rng.randint(0, n_frames - seed_length)
+            # np.array copies just this window out of the read-only map
+            window = np.array(features[:, start_idx:start_idx + seed_length], dtype=np.float32)
+        else:
+            # Pad if too short
+            window = np.pad(np.array(features, dtype=np.float32),
+                            ((0, 0), (0, seed_length - n_frames)), mode='constant')
+
+        with self._lock:
+            self.samples_served += 1
+        return window.T
+
+    def record_fallback(self, reason):
+        """Count a fallback to random seeds, reporting the first one loudly."""
+        with self._lock:
+            self.fallbacks += 1
+            first = self.fallbacks == 1
+        if first:
+            print(f"WARNING: seed pool unavailable ({reason}); "
+                  f"falling back to random noise seeds")
+
+    def describe(self):
+        """Summary of the pool for health checks and logs."""
+        return {
+            'source': self.source,
+            'metadata_csv': self.metadata_csv,
+            'corpus': self.corpus.describe() if self.corpus is not None else None,
+            'files': len(self.entries),
+            'frames': int(sum(n for _, n in self.entries)),
+            'skipped_files': len(self.skipped),
+            'samples_served': self.samples_served,
+            'fallbacks': self.fallbacks,
+            'error': self.error,
+        }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_seed_pool(metadata_csv, corpus_path=None):
+    """Return the process-wide SeedPool for a metadata file (and packed corpus), building it on first use."""
+    key = (os.path.abspath(metadata_csv), corpus_path and os.path.abspath(corpus_path))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = SeedPool(metadata_csv, corpus_path)
+            _pools[key] = pool
+            if pool.source == 'corpus':
+                print(f"Seed pool: {len(pool.entries)} tracks from packed corpus {corpus_path}")
+            elif pool.available:
+                print(f"Seed pool: indexed {len(pool.entries)} files from {metadata_csv}")
+            if pool.skipped:
+                print(f"Seed pool: skipped {len(pool.skipped)} unreadable feature files")
+        return pool
@@ -0,0 +1,522 @@
+"""Inference serving for the generation API: admission control plus micro-batching.
+
+Requests submit rollout jobs to an InferenceServer. A dispatcher thread
+collects jobs that arrive within a short window, rolls them out together with
+one generate_batch call and hands each request its own slice back. Rollouts
+run either on the already-loaded in-process model (workers=1) or on a pool of
+worker processes.
+
+Every job carries the model version (registry.py) its request pinned, and
+only jobs on the same version share a batch. Workers map each version's
+shared weights the first time they see it; prepare() does that ahead of a
+swap so no request waits for it.
+
+A job may also carry a generate.Deadline. Jobs whose deadline passes while
+queued fail with DeadlineExceeded; a job whose deadline passes mid-rollout
+gets the frames generated so far right away (worker processes send them
+back on a queue) and leaves the batch, which carries on for the others.
+
+Successive-halving searches batch the same way, with other searches only:
+each prunes its own candidates at its own rungs inside the shared rollout.
+
+If a worker process dies, the batches it was running fail, the pool is
+replaced with fresh workers and dispatching carries on; describe() reports
+whether the dispatcher and the pool are usable.
+"""
+import itertools
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+
+from generate import (
+    DeadlineExceeded, generate_batch, configure_torch_threads, iter_rollout, successive_halving_groups, warm_up
+)
+from metrics import RolloutTimer
+from registry import load_shared_model
+
+
+POOL_CHECK_INTERVAL_S = 0.5  # How often an idle dispatcher checks for a broken worker pool
+
+
+class ServerBusy(Exception):
+    """Raised when the server is at its concurrency limit; the API answers 503."""
+
+
+# Versions this worker process has warmed up, is loading in the background, or failed to load
+_worker_warm = set()
+_worker_loading = {}
+_worker_failed = {}
+_worker_early_results = None  # Queue for the frames of jobs whose deadline expired mid-batch
+
+
+def _init_worker(num_threads, spec, early_results):
+    global _worker_early_results
+    _worker_early_results = early_results
+    configure_torch_threads(num_threads)
+    _worker_model(spec)
+
+
+def _worker_model(spec):
+    loading = _worker_loading.get(spec)
+    if loading is not None and loading is not threading.current_thread():
+        loading.join()
+    model = load_shared_model(spec)
+    if spec not in _worker_warm:
+        warm_up(model)
+        _worker_warm.add(spec)
+    return model
+
+
+def _worker_ready(hold_s):
+    # Holding briefly keeps one worker from taking every startup ping
+    time.sleep(hold_s)
+    return os.getpid()
+
+
+def _load_in_background(spec):
+    try:
+        _worker_model(spec)
+    except Exception as e:
+        _worker_failed[spec] = f"{type(e).__name__}: {e}"
+    finally:
+        _worker_loading.pop(spec, None)
+
+
+def _worker_prepare(spec, hold_s):
+    """Start loading spec on a background thread, so the worker keeps serving; returns (pid, warm)."""
+    if spec in _worker_failed:
+        raise RuntimeError(f"worker {os.getpid()} could not load model {spec.version}: {_worker_failed[spec]}")
+    if spec not in _worker_warm and spec not in _worker_loading:
+        thread = threading.Thread(target=_load_in_background, args=(spec,), daemon=True)
+        _worker_loading[spec] = thread
+        thread.start()
+    time.sleep(hold_s)
+    return os.getpid(), spec in _worker_warm
+
+
+def _generate_jobs(model, temperatures, seed_length, total_length, seed, groups, timer=None, on_expired=None):
+    """generate_batch for several jobs' candidates at once, each job with its own deadline.
+
+    groups lists (n_candidates, deadline or None) per job, in the order of
+    temperatures. When a job's deadline expires its candidates are dropped
+    from the rollout and on_expired(job index, frames so far) is called.
+    Returns one (n_candidates, T, n_mels) array per job, T < total_length if
+    truncated, or None for jobs already handed to on_expired.
+    """
+    if len(groups) == 1:
+        return [generate_batch(model, temperatures, seed_length=seed_length, total_length=total_length, seed=seed,
+                               timer=timer, deadline=groups[0][1])]
+
+    results = [None] * len(groups)
+    live = list(range(len(groups)))  # Jobs still rolling out, in batch order
+    chunk_frames = total_length if all(deadline is None for _, deadline in groups) else 1
+    rollout = iter_rollout(model, temperatures, seed_length, total_length, seed=seed, chunk_frames=chunk_frames,
+                           timer=timer)
+    keep = None
+    while True:
+        try:
+            frames, n_frames = rollout.send(keep)
+        except StopIteration:
+            if keep is not None:
+                # Jobs expired at the last frame; the rollout ended without a pruned buffer
+                frames = frames[keep]
+            break
+        keep = None
+        expired = {g for g in live if groups[g][1] is not None and groups[g][1].expired()}
+        if not expired:
+            continue
+        rows, start = [], 0
+        for g in live:
+            n = groups[g][0]
+            if g in expired:
+                results[g] = frames[start:start + n, :n_frames].copy()
+                if on_expired is not None:
+                    on_expired(g, results[g])
+                    results[g] = None
+            else:
+                rows.extend(range(start, start + n))
+            start += n
+        live = [g for g in live if g not in expired]
+        if not live:
+            rollout.close()
+            return results
+        keep = rows
+
+    start = 0
+    for g in live:
+        n = groups[g][0]
+        results[g] = frames[start:start + n, :n_frames]
+        start += n
+    return results
+
+
+def _worker_generate(spec, temperatures, seed_length, total_length, seed, groups, job_ids):
+    # Timings travel back with the result so the serving process can publish them
+    timer = RolloutTimer()
+    result = _generate_jobs(_worker_model(spec), temperatures, seed_length, total_length, seed, groups, timer=timer,
+                            on_expired=lambda g, frames: _worker_early_results.put((job_ids[g], frames)))
+    return result, timer.as_dict()
+
+
+def _worker_search(spec, temperatures, seed_length, total_length, seed, groups, job_ids):
+    timer = RolloutTimer()
+    result = successive_halving_groups(_worker_model(spec), temperatures, groups, seed_length, total_length,
+                                       seed=seed, timer=timer,
+                                       on_expired=lambda g, found: _worker_early_results.put((job_ids[g], found)))
+    return result, timer.as_dict()
+
+
+class _Job:
+    __slots__ = ('id', 'temperatures', 'seed_length', 'total_length', 'seed', 'search', 'version', 'deadline',
+                 'future')
+    _ids = itertools.count()
+
+    def __init__(self, temperatures, seed_length, total_length, seed=None, search=False, version=None, deadline=None):
+        self.temperatures = list(temperatures)
+        self.seed_length = seed_length
+        self.total_length = total_length
+        self.seed = seed
+        self.search = search
+        self.version = version
+        self.deadline = deadline
+        self.id = next(_Job._ids)
+        self.future = Future()
+
+    @property
+    def solo(self):
+        # A seeded rollout must own its random generators, so it doesn't share a batch
+        return self.seed is not None
+
+    @property
+    def key(self):
+        if self.solo:
+            return (self.seed_length, self.total_length, id(self))
+        return (self.seed_length, self.total_length, id(self.version), self.search)
+
+
+class InferenceServer:
+    """Micro-batching front end for generate_batch.
+
+    max_pending caps requests admitted at once (queued + running); beyond that,
+    submit raises ServerBusy. Jobs with the same rollout length, model
+    version and kind (plain rollout or search) that arrive within batch_window_ms are merged into one rollout
+    of at most max_batch_candidates candidates. version (a
+    registry.ModelVersion) is what jobs submitted without one run on.
+    """
+
+    def __init__(self, version, workers=1, max_pending=32, max_batch_candidates=48, batch_window_ms=5.0):
+        self.version = version
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.max_batch_candidates = max_batch_candidates
+        self.batch_window_s = batch_window_ms / 1000.0
+
+        self._queue = queue.Queue()
+        self._admission = threading.BoundedSemaphore(max_pending)
+        self._slots = threading.BoundedSemaphore(self.workers)
+        self._carry = []      # Jobs held back because their rollout length or version didn't match the batch
+        self._pool = None
+        self._pool_broken = False  # Set when a worker died; the dispatcher replaces the pool
+        self._dispatcher = None
+        self._early_results = None
+        self._early_jobs = {}  # Process mode: job id -> job, for jobs whose frames may come back early
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'requests': 0,
+            'rejected': 0,
+            'batches': 0,
+            'batched_candidates': 0,
+            'in_flight': 0,
+            'expired': 0,
+            'pool_restarts': 0,
+        }
+
+    @property
+    def mode(self):
+        return 'process' if self.workers > 1 else 'thread'
+
+    def start(self):
+        """Start the dispatcher (and worker processes), returning once every worker is warm."""
+        if self.mode == 'process':
+            if self.version.spec.weights_path is None:
+                raise ValueError("process mode needs a version loaded through the registry (shared weights)")
+            self._early_results = multiprocessing.get_context('spawn').Queue()
+            self._pool = self._new_pool()
+            self._ping_workers()
+            threading.Thread(target=self._early_results_loop, name='inference-early-results', daemon=True).start()
+
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name='inference-dispatcher', daemon=True)
+        self._dispatcher.start()
+        return self
+
+    def _new_pool(self):
+        threads_per_worker = max(1, (os.cpu_count() or 1) // self.workers)
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(threads_per_worker, self.version.spec, self._early_results),
+        )
+
+    def _restart_pool(self):
+        # A worker died (e.g. killed by the OOM killer): the executor is unusable, so start a fresh one.
+        # Its workers load the current version; jobs pinned to older ones map them on first use.
+        broken, self._pool = self._pool, self._new_pool()
+        broken.shutdown(wait=False, cancel_futures=True)
+        with self._stats_lock:
+            self.stats['pool_restarts'] += 1
+        try:
+            self._ping_workers()
+        except Exception as e:
+            print(f"Restarted inference workers failed to start: {type(e).__name__}: {e}")
+            return
+        self._pool_broken = False
+        print(f"Inference worker pool was broken; started a new one ({self.workers} workers)")
+
+    @property
+    def healthy(self):
+        """Whether the dispatcher is running and (in process mode) the worker pool can take work."""
+        return self._dispatcher is not None and self._dispatcher.is_alive() and not self._pool_broken
+
+    def prepare(self, version, timeout_s=300):
+        """Load and warm up version in every worker, then make it the default for new jobs.
+
+        Workers load on a background thread and keep serving meanwhile. Jobs
+        already queued keep the version they were submitted with.
+        """
+        if self._pool is not None:
+            warm = set()
+            deadline = time.perf_counter() + timeout_s
+            while len(warm) < self.workers:
+                if time.perf_counter() > deadline:
+                    raise TimeoutError(f"workers did not load model {version.version} within {timeout_s}s")
+                # Short holds: a worker holding a ping isn't serving requests
+                pings = [self._pool.submit(_worker_prepare, version.spec, 0.02) for _ in range(self.workers)]
+                warm.update(pid for pid, ready in (p.result() for p in pings) if ready)
+                if len(warm) < self.workers:
+                    time.sleep(0.05)
+        self.version = version
+
+    def _ping_workers(self):
+        # Tasks go to whichever worker is free, so ping until every pid has answered
+        pids = set()
+        for _ in range(3):
+            pings = [self._pool.submit(_worker_ready, 0.2) for _ in range(self.workers)]
+            pids.update(p.result() for p in pings)
+            if len(pids) >= self.workers:
+                break
+
+    def submit(self, temperatures, seed_length, total_length, seed=None, search=False, version=None, deadline=None):
+        """Queue a rollout and return a Future resolving to an (N, T, n_mels) array.
+
+        With search=True the job runs a successive-halving search instead
+        (batched with other searches, see generate.successive_halving_groups)
+        and the Future resolves to its (best_sequence, best_score, search) result.
+        The rollout uses version, else the server's current default. With a
+        deadline (a generate.Deadline), T falls short of total_length if it
+        expires mid-rollout, and the Future fails with DeadlineExceeded if it
+        expires before the job starts.
+        """
+        if not self._admission.acquire(blocking=False):
+            with self._stats_lock:
+                self.stats['rejected'] += 1
+            raise ServerBusy(f"{self.max_pending} requests already pending")
+
+        job = _Job(temperatures, seed_length, total_length, seed, search, version or self.version, deadline)
+        job.future.add_done_callback(lambda _: self._admission.release())
+        with self._stats_lock:
+            self.stats['requests'] += 1
+        self._queue.put(job)
+        return job.future
+
+    @contextmanager
+    def slot(self):
+        """Hold one admission slot for work that runs outside the batcher (e.g. streaming)."""
+        if not self._admission.acquire(blocking=False):
+            with self._stats_lock:
+                self.stats['rejected'] += 1
+            raise ServerBusy(f"{self.max_pending} requests already pending")
+        with self._stats_lock:
+            self.stats['requests'] += 1
+        try:
+            yield
+        finally:
+            self._admission.release()
+
+    def generate(self, temperatures, seed_length, total_length, seed=None, timeout=None, version=None, deadline=None):
+        """Blocking form of submit."""
+        future = self.submit(temperatures, seed_length, total_length, seed, version=version, deadline=deadline)
+        return future.result(timeout=timeout)
+
+    def search(self, temperatures, seed_length, total_length, seed=None, timeout=None, version=None, deadline=None):
+        """Blocking successive-halving search; returns (best_sequence, best_score, search)."""
+        future = self.submit(temperatures, seed_length, total_length, seed, search=True, version=version,
+                             deadline=deadline)
+        return future.result(timeout=timeout)
+
+    def describe(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['avg_batch_candidates'] = (stats['batched_candidates'] / stats['batches']) if stats['batches'] else 0.0
+        stats.update({
+            'mode': self.mode,
+            'workers': self.workers,
+            'healthy': self.healthy,
+            'dispatcher_alive': self._dispatcher is not None and self._dispatcher.is_alive(),
+            'pool_broken': self._pool_broken,
+            'version': self.version.version,
+            'precision': self.version.precision,
+            'max_pending': self.max_pending,
+            'queued': self._queue.qsize() + len(self._carry),
+            'max_batch_candidates': self.max_batch_candidates,
+            'batch_window_ms': self.batch_window_s * 1000.0,
+        })
+        return stats
+
+    def _next_job(self):
+        if self._carry:
+            return self._carry.pop(0)
+        while True:
+            try:
+                return self._queue.get(timeout=POOL_CHECK_INTERVAL_S)
+            except queue.Empty:
+                # Replace a broken pool while idle too, so the server recovers before the next request
+                if self._pool_broken:
+                    self._restart_pool()
+
+    def _collect_batch(self):
+        """Block for one job, then gather compatible jobs for up to batch_window_s."""
+        first = self._next_job()
+        batch = [first]
+        if first.solo:
+            return batch
+        n_candidates = len(first.temperatures)
+
+        # Jobs held back from earlier batches join first, so a held burst runs together
+        held = []
+        for job in self._carry:
+            if job.key == first.key and n_candidates + len(job.temperatures) <= self.max_batch_candidates:
+                batch.append(job)
+                n_candidates += len(job.temperatures)
+            else:
+                held.append(job)
+        self._carry = held
+        held = []
+        deadline = time.perf_counter() + self.batch_window_s
+
+        while n_candidates < self.max_batch_candidates:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                job = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if job.key != first.key or n_candidates + len(job.temperatures) > self.max_batch_candidates:
+                held.append(job)
+                continue
+            batch.append(job)
+            n_candidates += len(job.temperatures)
+
+        self._carry.extend(held)
+        return batch
+
+    def _dispatch_loop(self):
+        while True:
+            batch = [job for job in self._collect_batch() if not self._drop_if_expired(job)]
+            if not batch:
+                continue
+            temperatures = [t for job in batch for t in job.temperatures]
+            seed_length, total_length, seed = batch[0].seed_length, batch[0].total_length, batch[0].seed
+            search, version = batch[0].search, batch[0].version
+            # Each job keeps its own deadline (and a search its own rungs) inside the shared rollout
+            groups = [(len(job.temperatures), job.deadline) for job in batch]
+
+            with self._stats_lock:
+                self.stats['batches'] += 1
+                self.stats['batched_candidates'] += len(temperatures)
+                self.stats['in_flight'] += 1
+
+            if self._pool is None:
+                try:
+                    on_expired = lambda g, found, batch=batch: batch[g].future.set_result(found)
+                    if search:
+                        result = successive_halving_groups(version.model, temperatures, groups, seed_length,
+                                                           total_length, seed=seed, on_expired=on_expired)
+                    else:
+                        result = _generate_jobs(version.model, temperatures, seed_length, total_length, seed, groups,
+                                                on_expired=on_expired)
+                except Exception as e:
+                    self._fail(batch, e)
+                else:
+                    self._deliver(batch, result)
+                continue
+
+            # Process mode: at most one batch in flight per worker
+            self._slots.acquire()
+            try:
+                if self._pool_broken:
+                    self._restart_pool()
+                self._early_jobs.update((job.id, job) for job in batch)
+                future = self._pool.submit(_worker_search if search else _worker_generate, version.spec,
+                                           temperatures, seed_length, total_length, seed, groups,
+                                           [job.id for job in batch])
+            except Exception as e:
+                # Keep dispatching: fail this batch, and replace the pool if a worker died
+                self._slots.release()
+                self._fail(batch, e)
+                if isinstance(e, BrokenProcessPool):
+                    self._pool_broken = True
+                continue
+            future.add_done_callback(lambda f, batch=batch: self._on_pool_done(batch, f))
+
+    def _drop_if_expired(self, job):
+        # A job whose request has already given up (or run out of time) isn't worth a rollout
+        if job.deadline is None or not job.deadline.expired():
+            return False
+        with self._stats_lock:
+            self.stats['expired'] += 1
+        job.future.set_exception(DeadlineExceeded("deadline passed before the rollout started"))
+        return True
+
+    def _early_results_loop(self):
+        while True:
+            job_id, frames = self._early_results.get()
+            job = self._early_jobs.pop(job_id, None)
+            if job is not None:
+                job.future.set_result(frames)
+
+    def _on_pool_done(self, batch, future):
+        self._slots.release()
+        try:
+            result, timings = future.result()
+            RolloutTimer.from_dict(timings).publish()
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                # Replaced by the dispatcher before its next batch, not from this executor thread
+                self._pool_broken = True
+            self._fail(batch, e)
+        else:
+            self._deliver(batch, result)
+
+    def _deliver(self, batch, result):
+        for job, found in zip(batch, result):
+            # None: the job's deadline expired and its result was delivered early
+            if found is not None:
+                self._early_jobs.pop(job.id, None)
+                job.future.set_result(found)
+        with self._stats_lock:
+            self.stats['in_flight'] -= 1
+
+    def _fail(self, batch, error):
+        for job in batch:
+            self._early_jobs.pop(job.id, None)
+            if not job.future.done():
+                job.future.set_exception(error)
+        with self._stats_lock:
+            self.stats['in_flight'] -= 1